@@ -1,62 +1,225 @@
-from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException
-from sqlalchemy.orm import Session
-from app.db import models
-from app.db.session import get_db, SessionLocal
-from app.services.ai_workflow import run_analysis
+import asyncio
 import json
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import models
+from app.db.session import get_async_db
+from app.core.config import settings
+from app.schemas import schemas
+from app.services.analysis_history import STATUSES, InvalidCursor, list_analyses
+from app.services.analysis_jobs import (
+    find_fresh_analysis, find_inflight_analysis, enqueue_analysis, enqueue_batch, get_or_create_companies,
+)
+from app.services.progress import progress_hub, is_final_event
+from app.services.request_counts import request_counter
 
 router = APIRouter()
 
-def run_ai_task(analysis_log_id: int, company_ticker: str, db: Session):
-    try:
-        print(f"Starting AI task for log {analysis_log_id}")
-        result = run_analysis(company_ticker)
-        
-        log = db.query(models.AnalysisLog).filter(models.AnalysisLog.id == analysis_log_id).first()
-        if log:
-            log.status = 'completed'
-            log.result_json = json.loads(json.dumps(result))
-            db.commit()
-        print(f"Completed AI task for log {analysis_log_id}")
-
-    except Exception as e:
-        print(f"AI task failed for log {analysis_log_id}: {e}")
-        log = db.query(models.AnalysisLog).filter(models.AnalysisLog.id == analysis_log_id).first()
-        if log:
-            log.status = 'failed'
-            db.commit()
-    finally:
-        db.close()
-
 
 @router.post("/start-analysis")
-async def start_company_analysis(ticker: str, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    company = db.query(models.Company).filter(models.Company.ticker_symbol == ticker).first()
-    if not company:
-        company = models.Company(name=ticker, ticker_symbol=ticker)
-        db.add(company)
-        db.commit()
-        db.refresh(company)
+async def start_company_analysis(ticker: str, db: AsyncSession = Depends(get_async_db)):
+    company = (await get_or_create_companies(db, [ticker]))[ticker]
+    request_counter.record([company.id])
+
+    # Serve a recent result straight from the log instead of re-running the graph
+    fresh_log = await find_fresh_analysis(db, company.id)
+    if fresh_log:
+        return {"analysis_id": fresh_log.id, "status": fresh_log.status, "result": fresh_log.result_json}
 
-    new_log = models.AnalysisLog(company_id=company.id, status='pending')
-    db.add(new_log)
-    db.commit()
-    db.refresh(new_log)
-    
-    # Pass a new session to the background task
-    background_tasks.add_task(run_ai_task, new_log.id, company.ticker_symbol, SessionLocal())
+    # Attach to an analysis that is already queued or running for this ticker
+    inflight_log = await find_inflight_analysis(db, company.id)
+    if inflight_log:
+        return {"analysis_id": inflight_log.id, "status": inflight_log.status}
 
-    return {"analysis_id": new_log.id}
+    # The analysis itself runs in `python -m app.worker`; the API only enqueues it.
+    # Requests that race past the check above all get the one job that wins the insert.
+    new_log = await enqueue_analysis(db, company.id)
+
+    return {"analysis_id": new_log.id, "status": new_log.status}
 
 
 @router.get("/analysis-status/{analysis_id}")
-def get_analysis_status(analysis_id: int, db: Session = Depends(get_db)):
-    log = db.query(models.AnalysisLog).filter(models.AnalysisLog.id == analysis_id).first()
+async def get_analysis_status(analysis_id: int, db: AsyncSession = Depends(get_async_db)):
+    log = await db.get(models.AnalysisLog, analysis_id)
     if not log:
         raise HTTPException(status_code=404, detail="Analysis not found")
-    
+
     return {
         "analysis_id": log.id,
         "status": log.status,
-        "result": log.result_json if log.status == 'completed' else None
-    }
\ No newline at end of file
+        "result": log.result_json if log.status == 'completed' else None,
+        "error": log.error if log.status == 'failed' else None,
+    }
+
+
+@router.get("/stream/{analysis_id}")
+async def stream_analysis(analysis_id: int):
+    """
+    Server-sent events: `status`, one `node` event per finished graph node, then `completed` or `failed`.
+    A retry sends `status` again with its attempt number, followed by the new attempt's nodes.
+    """
+    async def event_stream():
+        subscription = progress_hub.subscribe(analysis_id)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=settings.PROGRESS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+                if is_final_event(event):
+                    break
+        finally:
+            progress_hub.unsubscribe(subscription)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.websocket("/ws/{analysis_id}")
+async def analysis_websocket(websocket: WebSocket, analysis_id: int):
+    await websocket.accept()
+    subscription = progress_hub.subscribe(analysis_id)
+
+    async def send_events():
+        while True:
+            event = await subscription.queue.get()
+            await websocket.send_json(event)
+            if is_final_event(event):
+                await websocket.close()
+                return
+
+    async def receive_until_disconnect():
+        # Sends alone never notice a client that left while its analysis is quiet
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(send_events()), asyncio.create_task(receive_until_disconnect())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        progress_hub.unsubscribe(subscription)
+
+
+@router.post("/batch")
+async def start_batch_analysis(data: schemas.BatchAnalysisRequest, db: AsyncSession = Depends(get_async_db)):
+    tickers = list(dict.fromkeys(ticker.strip() for ticker in data.tickers if ticker.strip()))
+    if not tickers:
+        raise HTTPException(status_code=400, detail="No tickers provided")
+    if len(tickers) > settings.BATCH_MAX_TICKERS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {settings.BATCH_MAX_TICKERS} tickers")
+
+    companies = await get_or_create_companies(db, tickers)
+    request_counter.record(company.id for company in companies.values())
+
+    batch, children = await enqueue_batch(db, [companies[ticker] for ticker in tickers])
+    tickers_by_company = {company.id: ticker for ticker, company in companies.items()}
+
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "analysis_ids": {tickers_by_company[log.company_id]: log.id for log in children},
+    }
+
+
+@router.get("/batch/{batch_id}")
+async def get_batch_status(batch_id: int, include_results: bool = False, db: AsyncSession = Depends(get_async_db)):
+    batch = await db.get(models.AnalysisBatch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    # All children and their tickers in a single query
+    columns = [models.AnalysisLog.id, models.AnalysisLog.status, models.AnalysisLog.error, models.Company.ticker_symbol]
+    if include_results:
+        columns.append(models.AnalysisLog.result_json)
+    result = await db.execute(select(*columns).join(models.Company, models.AnalysisLog.company_id == models.Company.id).where(
+        models.AnalysisLog.batch_id == batch_id
+    ).order_by(models.AnalysisLog.id))
+    rows = result.all()
+
+    counts = {"pending": 0, "running": 0, "completed": 0, "failed": 0}
+    analyses = []
+    for row in rows:
+        counts[row.status] = counts.get(row.status, 0) + 1
+        child = {"analysis_id": row.id, "ticker": row.ticker_symbol, "status": row.status}
+        if row.status == 'failed':
+            child["error"] = row.error
+        if include_results and row.status == 'completed':
+            child["result"] = row.result_json
+        analyses.append(child)
+
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "total": len(rows),
+        "counts": counts,
+        "analyses": analyses,
+    }
+
+
+async def history_page(db: AsyncSession, limit: int, cursor: Optional[str], include_results: bool, **filters):
+    try:
+        items, next_cursor = await list_analyses(db, limit=limit, cursor=cursor, include_results=include_results, **filters)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@router.get("/history", response_model=schemas.AnalysisHistoryPage, response_model_exclude_unset=True)
+async def get_history(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    include_results: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await history_page(db, limit, cursor, include_results)
+
+
+@router.get("/history/user/{user_id}", response_model=schemas.AnalysisHistoryPage, response_model_exclude_unset=True)
+async def get_user_history(
+    user_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    include_results: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await history_page(db, limit, cursor, include_results, user_id=user_id)
+
+
+@router.get("/history/company/{ticker}", response_model=schemas.AnalysisHistoryPage, response_model_exclude_unset=True)
+async def get_company_history(
+    ticker: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    include_results: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
+    result = await db.execute(select(models.Company.id).where(models.Company.ticker_symbol == ticker))
+    company_id = result.scalar()
+    if company_id is None:
+        raise HTTPException(status_code=404, detail="Company not found")
+    return await history_page(db, limit, cursor, include_results, company_id=company_id)
+
+
+@router.get("/history/status/{status}", response_model=schemas.AnalysisHistoryPage, response_model_exclude_unset=True)
+async def get_status_history(
+    status: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    include_results: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
+    if status not in STATUSES:
+        raise HTTPException(status_code=400, detail=f"Status must be one of {', '.join(STATUSES)}")
+    return await history_page(db, limit, cursor, include_results, status=status)
@@ -1,40 +1,104 @@
-import httpx
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+import asyncio
+import time
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.db import models
-from app.db.session import get_db
+from app.db.session import dialect_insert, get_async_db
 from app.core.config import settings
+from app.core.http import get_http_client
+from app.core.metrics import track_external_call
+from app.core.outbound import OutboundError, call
+from app.services.fundamentals import METRICS, TEXT_INFO_FIELDS, fundamentals
+from app.services.ticker_index import ticker_index
 
 router = APIRouter()
 FMP_API_KEY = settings.FINANCIAL_MODELING_PREP_API_KEY
 
 @router.get("/countries")
-async def get_countries_from_db(db: Session = Depends(get_db)):
-    countries = db.query(models.Country).all()
+async def get_countries_from_db(db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(models.Country))
+    countries = result.scalars().all()
     if not countries:
-        async with httpx.AsyncClient() as client:
-            response = await client.get("https://restcountries.com/v3.1/all?fields=name,cca2")
-            if response.status_code == 200:
-                country_data = response.json()
-                for c in country_data:
-                    country_exists = db.query(models.Country).filter(models.Country.code == c['cca2']).first()
-                    if not country_exists:
-                        new_country = models.Country(name=c['name']['common'], code=c['cca2'])
-                        db.add(new_country)
-                db.commit()
-                countries = db.query(models.Country).order_by(models.Country.name).all()
+        client = get_http_client()
+        with track_external_call("restcountries", "all"):
+            response = await client.get("https://restcountries.com/v3.1/all", params={"fields": "name,cca2"})
+        if response.status_code == 200:
+            rows = {c['cca2']: {"name": c['name']['common'], "code": c['cca2']} for c in response.json()}
+            # Concurrent first calls all get here; rows another request inserted first are skipped
+            if rows:
+                insert = dialect_insert(db.get_bind().dialect.name)
+                await db.execute(insert(models.Country).values(list(rows.values())).on_conflict_do_nothing())
+                await db.commit()
+            result = await db.execute(select(models.Country).order_by(models.Country.name))
+            countries = result.scalars().all()
     return countries
 
 @router.get("/search-companies")
 async def search_companies(query: str):
-    if not query:
+    if not query.strip():
         return []
-    url = f"https://financialmodelingprep.com/api/v3/search-ticker?query={query}&limit=10&apikey={FMP_API_KEY}"
-    async with httpx.AsyncClient() as client:
+
+    # Answer from the local index; only go to FMP when it has nothing for the query
+    matches = ticker_index.search(query, limit=10)
+    if matches:
+        return [{"id": i, "name": c['name'], "ticker_symbol": c['ticker_symbol']} for i, c in enumerate(matches)]
+
+    client = get_http_client()
+
+    async def fetch():
+        response = await client.get(
+            "https://financialmodelingprep.com/api/v3/search-ticker",
+            params={"query": query, "limit": 10, "apikey": FMP_API_KEY},
+        )
+        response.raise_for_status()
+        return response
+
+    try:
+        response = await call("fmp", "search-ticker", fetch)
+        data = response.json()
+    except OutboundError as e:
+        # Upstream client errors keep their status; rate limits, outages and open breakers are a 503
+        status_code = getattr(getattr(e.error, "response", None), "status_code", 502) if e.kind == "client" else 503
+        raise HTTPException(status_code=status_code, detail="Failed to fetch from FMP API")
+    ticker_index.remember({"name": c['name'], "ticker_symbol": c['symbol']} for c in data)
+    return [{"id": i, "name": c['name'], "ticker_symbol": c['symbol']} for i, c in enumerate(data)]
+
+@router.get("/screener")
+async def screen_companies(
+    request: Request,
+    sector: Optional[str] = None,
+    sort_by: str = "market_cap",
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=settings.SCREENER_MAX_RESULTS),
+):
+    """
+    Filters every ticker in the fundamentals store. Bounds are passed as min_<metric> /
+    max_<metric>, e.g. ?min_revenue_cagr=0.1&max_debt_to_equity=1&sort_by=net_margin.
+    """
+    minimums, maximums = {}, {}
+    for key, value in request.query_params.items():
+        bound, _, metric = key.partition("_")
+        if bound not in ("min", "max") or not metric:
+            continue
+        if metric not in METRICS:
+            raise HTTPException(status_code=400, detail=f"Unknown metric '{metric}'")
         try:
-            response = await client.get(url)
-            response.raise_for_status()
-            data = response.json()
-            return [{"id": i, "name": c['name'], "ticker_symbol": c['symbol']} for i, c in enumerate(data)]
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=e.response.status_code, detail="Failed to fetch from FMP API")
\ No newline at end of file
+            (minimums if bound == "min" else maximums)[metric] = float(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"'{key}' must be a number")
+    if sort_by not in METRICS and sort_by not in TEXT_INFO_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by '{sort_by}'")
+
+    started = time.perf_counter()
+    # Filtering, and a table rebuild after updates, is pandas work; keep it off the event loop
+    count, results = await asyncio.to_thread(
+        fundamentals.store.screen, minimums, maximums, sector, sort_by, order == "desc", limit
+    )
+    return {
+        "universe": len(fundamentals.store),
+        "count": count,
+        "results": results,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
@@ -1,4 +1,5 @@
 import os
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 load_dotenv()
@@ -15,6 +16,103 @@ class Settings(BaseSettings):
     email_api_key: str
     sender_email: str
 
+    # Password hashing
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 64
+    PASSWORD_HASH_USE_PROCESSES: bool = False
+
+    # Database pools (per engine, per process)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: int = 30
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+
+    # Analysis result cache / single-flight
+    ANALYSIS_CACHE_TTL_SECONDS: int = 900
+    # Reuse stored graph steps whose inputs hash the same as in the last completed run
+    ANALYSIS_REUSE_INTERMEDIATES: bool = True
+
+    # Analysis job queue / worker
+    ANALYSIS_MAX_ATTEMPTS: int = 3
+    ANALYSIS_CLAIM_TIMEOUT_SECONDS: int = 300
+    WORKER_PROCESSES: int = 1
+    WORKER_CONCURRENCY: int = 4
+    WORKER_POLL_INTERVAL_SECONDS: float = 1.0
+    WORKER_METRICS_PORT: int = 0
+    WORKER_WARM_UP: bool = True
+    BATCH_MAX_TICKERS: int = 50
+    BATCH_LLM_CONCURRENCY: int = 4
+
+    # Cache-warming scheduler (python -m app.scheduler)
+    REQUEST_COUNTS_FLUSH_SECONDS: int = 30  # how often the API writes buffered per-company request counts
+    SCHEDULER_INTERVAL_SECONDS: int = 300
+    SCHEDULER_WINDOWS: str = ""  # UTC hour ranges such as "0-7,22-24"; empty means always
+    SCHEDULER_TOP_TICKERS: int = 50
+    SCHEDULER_POPULARITY_DAYS: int = 7
+    SCHEDULER_REFRESH_LEAD_SECONDS: int = 60
+    SCHEDULER_MAX_CONCURRENT: int = 4
+    SCHEDULER_BUDGET_WINDOW_SECONDS: int = 3600
+    SCHEDULER_ANALYSES_PER_WINDOW: int = 100  # each is ~1 Tavily and up to 3 LLM calls
+    SCHEDULER_MARKET_DATA_PER_WINDOW: int = 500  # tickers; each is up to 2 yfinance calls
+
+    # Ticker search index
+    TICKER_INDEX_REFRESH_SECONDS: int = 300
+    TICKER_INDEX_LISTING_REFRESH_SECONDS: int = 86400
+    TICKER_INDEX_FUZZY_THRESHOLD: float = 0.5
+    TICKER_INDEX_FUZZY_MAX_CANDIDATES: int = 500  # entries a fuzzy lookup may score; bounds its time on the event loop
+
+    # Fundamentals store / screener (fed from the market-data disk cache)
+    FUNDAMENTALS_REFRESH_SECONDS: int = 60
+    FUNDAMENTALS_BACKFILL_TICKERS: int = 0  # companies without market data the scheduler fetches per pass, within its market-data budget; 0 disables
+    SCREENER_MAX_RESULTS: int = 500
+
+    # Progress streaming
+    PROGRESS_POLL_INTERVAL_SECONDS: float = 0.5
+    PROGRESS_KEEPALIVE_SECONDS: float = 15.0
+
+    # Outbound calls to Gemini, Tavily, FMP and Yahoo (rates in requests per second per host)
+    OUTBOUND_LIMITER_PATH: str = ".cache/rate_limits.sqlite3"  # shared by local processes; empty = per process
+    OUTBOUND_RATE_LIMITS: Dict[str, float] = {"gemini": 2.0, "tavily": 5.0, "fmp": 5.0, "yfinance": 4.0}
+    OUTBOUND_DEFAULT_RATE: float = 5.0
+    OUTBOUND_BURST_SECONDS: float = 2.0
+    OUTBOUND_MAX_ATTEMPTS: int = 4
+    OUTBOUND_BACKOFF_BASE_SECONDS: float = 0.5
+    OUTBOUND_BACKOFF_MAX_SECONDS: float = 20.0
+    OUTBOUND_BREAKER_FAILURES: int = 5
+    OUTBOUND_BREAKER_RESET_SECONDS: float = 30.0
+    LLM_HEDGE_AFTER_SECONDS: float = 0.0  # 0 disables hedged LLM requests
+
+    # AI workflow
+    YFINANCE_MAX_WORKERS: int = 8
+    LLM_MODEL: str = "gemini-1.5-pro-latest"
+    # Per graph node; nodes not listed use LLM_MODEL
+    LLM_NODE_MODELS: Dict[str, str] = {
+        "financial_analyst": "gemini-1.5-flash-latest",
+        "market_analyst": "gemini-1.5-flash-latest",
+    }
+    LLM_ESCALATE_ON_INVALID: bool = True  # retry on LLM_ESCALATION_MODEL when structured output fails to parse
+    LLM_ESCALATION_MODEL: str = ""  # empty = LLM_MODEL
+    # USD per million tokens, [prompt, completion]; models not listed are costed at 0
+    LLM_MODEL_PRICES: Dict[str, List[float]] = {
+        "gemini-1.5-pro-latest": [3.50, 10.50],
+        "gemini-1.5-flash-latest": [0.35, 1.05],
+    }
+    FINANCIAL_KEY_METRICS_FROM_DATA: bool = True  # key_metrics from market data; the LLM only writes the summary
+    LLM_CACHE_BACKEND: str = "sqlite"  # sqlite, memory or none
+    LLM_CACHE_PATH: str = ".cache/llm_responses.sqlite3"
+    LLM_CACHE_MAX_ENTRIES: int = 5000
+
+    # News context (estimated tokens per prompt; 0 disables the budget)
+    NEWS_CONTEXT_MARKET_TOKENS: int = 1000
+    NEWS_DEDUPE_THRESHOLD: float = 0.8
+
+    # Market data cache
+    MARKET_DATA_INFO_TTL_SECONDS: int = 300
+    MARKET_DATA_FINANCIALS_TTL_SECONDS: int = 86400
+    MARKET_DATA_CACHE_MAX_ENTRIES: int = 1024
+    MARKET_DATA_CACHE_PATH: str = ".cache/market_data.sqlite3"
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,26 @@
+from typing import Optional
+
+import httpx
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Process-wide AsyncClient so outbound calls reuse pooled connections."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=5.0))
+    return _client
+
+
+def set_http_client(client: httpx.AsyncClient):
+    """Replaces the shared client, e.g. with one using httpx.MockTransport."""
+    global _client
+    _client = client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,55 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+
+class EventLoopMonitor:
+    """
+    Measures how long the event loop is blocked: a task asks to wake up every `interval`
+    seconds and records how late it actually ran. Any lateness is time the loop spent on
+    something that did not yield.
+    """
+
+    def __init__(self, interval: float = 0.1, blocked_threshold: float = 0.05):
+        self.interval = interval
+        self.blocked_threshold = blocked_threshold
+        self.samples = 0
+        self.blocked_samples = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            if lag >= self.blocked_threshold:
+                self.blocked_samples += 1
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "samples": self.samples,
+            "blocked_samples": self.blocked_samples,
+            "lag_seconds_avg": self.lag_total / self.samples if self.samples else 0.0,
+            "lag_seconds_max": self.lag_max,
+        }
+
+
+loop_monitor = EventLoopMonitor()
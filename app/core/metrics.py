@@ -0,0 +1,163 @@
+import functools
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytz
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import func
+
+# OpenTelemetry is optional: spans are emitted only when the SDK is installed and configured
+try:
+    from opentelemetry import trace
+    tracer = trace.get_tracer("investment-advisor")
+except ImportError:
+    tracer = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "API request latency", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+NODE_DURATION = Histogram(
+    "analysis_node_duration_seconds", "Wall time per LangGraph node", ["node"], buckets=LATENCY_BUCKETS
+)
+NODE_ERRORS = Counter("analysis_node_errors_total", "LangGraph node failures", ["node"])
+STEPS_REUSED = Counter("analysis_steps_reused_total", "Graph steps served from the previous run's intermediates", ["step"])
+EXTERNAL_CALL_DURATION = Histogram(
+    "external_call_duration_seconds", "Latency of calls to external services", ["provider", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+EXTERNAL_CALL_ERRORS = Counter("external_call_errors_total", "Failed calls to external services", ["provider", "operation"])
+OUTBOUND_RETRIES = Counter("outbound_retries_total", "Retried external calls by error kind", ["provider", "kind"])
+OUTBOUND_REJECTED = Counter("outbound_circuit_rejections_total", "Calls refused by an open circuit breaker", ["provider"])
+OUTBOUND_HEDGES = Counter("outbound_hedged_requests_total", "Second requests started for slow calls", ["provider"])
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens by node, model and kind (prompt/completion)", ["node", "model", "kind"])
+NEWS_CONTEXT_TOKENS = Counter("news_context_tokens_total", "Estimated news tokens before (raw) and after packing (kept)", ["prompt", "kind"])
+LLM_COST = Counter("llm_cost_usd_total", "Estimated LLM spend in USD by node and model", ["node", "model"])
+LLM_CALL_DURATION = Histogram(
+    "llm_call_duration_seconds", "Latency of LLM calls by node and model, retries included", ["node", "model"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_ESCALATIONS = Counter("llm_escalations_total", "Calls retried on the escalation model after invalid output", ["node", "model"])
+LLM_CACHE_LOOKUPS = Counter("llm_cache_lookups_total", "LLM response cache lookups", ["node", "result"])
+ANALYSIS_JOBS = Counter("analysis_jobs_total", "Finished analysis jobs by outcome", ["kind", "outcome"])
+
+
+@contextmanager
+def span(name: str, **attributes):
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+@contextmanager
+def track_external_call(provider: str, operation: str):
+    """Times a call to an external service and counts it as an error if it raises."""
+    started = time.perf_counter()
+    with span(f"{provider}.{operation}", provider=provider):
+        try:
+            yield
+        except Exception:
+            EXTERNAL_CALL_ERRORS.labels(provider, operation).inc()
+            raise
+        finally:
+            EXTERNAL_CALL_DURATION.labels(provider, operation).observe(time.perf_counter() - started)
+
+
+def instrument_node(name: str, node):
+    """Wraps an async graph node with wall-time, error and span instrumentation."""
+    @functools.wraps(node)
+    async def wrapper(state):
+        started = time.perf_counter()
+        with span(f"node.{name}", node=name):
+            try:
+                return await node(state)
+            except Exception:
+                NODE_ERRORS.labels(name).inc()
+                raise
+            finally:
+                NODE_DURATION.labels(name).observe(time.perf_counter() - started)
+    return wrapper
+
+
+class StateCollector:
+    """
+    Gauges read at scrape time: analysis queue depth and age of the oldest pending job,
+    DB connection pool usage, market-data cache counters and event-loop lag.
+    """
+
+    def describe(self):
+        # Without this, registering the collector calls collect() at import time, which
+        # queries the database and imports app modules that may still be initializing
+        return []
+
+    def collect(self):
+        from app.db import models
+        from app.db.session import SessionLocal, async_engine, engine
+
+        depth = GaugeMetricFamily("analysis_queue_depth", "Analysis jobs by status", labels=["kind", "status"])
+        oldest = GaugeMetricFamily("analysis_queue_oldest_pending_seconds", "Age of the oldest pending job", labels=["kind"])
+        db = SessionLocal()
+        try:
+            now = datetime.now(pytz.utc)
+            for kind, model in (("analysis", models.AnalysisLog), ("batch", models.AnalysisBatch)):
+                rows = db.query(model.status, func.count(model.id), func.min(model.created_at)).filter(
+                    model.status.in_(['pending', 'running'])
+                ).group_by(model.status).all()
+                age = 0.0
+                for status, count, first_created in rows:
+                    depth.add_metric([kind, status], count)
+                    if status == 'pending' and first_created is not None:
+                        if first_created.tzinfo is None:
+                            first_created = first_created.replace(tzinfo=pytz.utc)
+                        age = max(age, (now - first_created).total_seconds())
+                oldest.add_metric([kind], age)
+        except Exception as e:
+            print(f"Queue metrics unavailable: {e}")
+        finally:
+            db.close()
+        yield depth
+        yield oldest
+
+        pool = GaugeMetricFamily("db_pool_connections", "DB pool connections by state", labels=["engine", "state"])
+        for engine_name, pool_engine in (("sync", engine), ("async", async_engine.sync_engine)):
+            for state in ("size", "checkedout", "overflow", "checkedin"):
+                reader = getattr(pool_engine.pool, state, None)
+                if callable(reader):
+                    pool.add_metric([engine_name, state], reader())
+        yield pool
+
+        from app.services.market_data import current_market_data_provider
+        # Only reported once something in this process has used market data; a scrape never builds the provider
+        provider = current_market_data_provider()
+        if hasattr(provider, "stats"):
+            cache = CounterMetricFamily("market_data_cache_events", "Market-data cache lookups", labels=["field", "event"])
+            for field, stats in provider.stats().items():
+                if isinstance(stats, dict):
+                    for event in ("memory_hits", "disk_hits", "misses"):
+                        cache.add_metric([field, event], stats[event])
+            yield cache
+
+        from app.core.outbound import breaker_states
+        breakers = GaugeMetricFamily("outbound_circuit_open", "1 while a provider's circuit breaker is open", labels=["provider"])
+        for provider, state in breaker_states().items():
+            breakers.add_metric([provider], 0 if state == "closed" else 1)
+        yield breakers
+
+        from app.core.loop_monitor import loop_monitor
+        lag = GaugeMetricFamily("event_loop_lag_seconds", "Event loop scheduling lag", labels=["stat"])
+        stats = loop_monitor.stats()
+        lag.add_metric(["avg"], stats["lag_seconds_avg"])
+        lag.add_metric(["max"], stats["lag_seconds_max"])
+        yield lag
+
+
+REGISTRY.register(StateCollector())
+
+
+def render_metrics():
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,396 @@
+"""
+Shared layer for calls to external APIs (Gemini, Tavily, FMP, Yahoo Finance):
+
+  * a token bucket per provider, shared by every process on the host through a SQLite
+    file; its rate halves on a 429 and creeps back up to the configured ceiling,
+  * retries with exponential backoff and full jitter for transient and rate-limit errors,
+    honouring Retry-After,
+  * a circuit breaker per provider and process that fails fast while the provider is down,
+  * optional hedging: a second identical request if the first is slow, first answer wins.
+
+Errors that escape carry the provider and a classification (rate_limited, transient,
+client, unknown, circuit_open) so failed jobs say what actually went wrong.
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+from app.core.metrics import OUTBOUND_HEDGES, OUTBOUND_REJECTED, OUTBOUND_RETRIES, track_external_call
+
+RETRYABLE = ("rate_limited", "transient")
+MIN_RATE_FRACTION = 0.05
+RECOVERY_STEP_FRACTION = 0.1
+
+_RATE_LIMIT_NAMES = {"ResourceExhausted", "TooManyRequests", "YFRateLimitError"}
+_TRANSIENT_NAMES = {"ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "BadGateway", "GatewayTimeout",
+                    # aiohttp, used by the Tavily client
+                    "ClientConnectorError", "ClientOSError", "ServerDisconnectedError", "ServerTimeoutError"}
+
+
+class OutboundError(Exception):
+    def __init__(self, provider: str, operation: str, kind: str, error: Optional[BaseException] = None):
+        self.provider = provider
+        self.operation = operation
+        self.kind = kind
+        self.error = error
+        super().__init__(f"{provider} {operation} failed ({kind}): {error}")
+
+
+class CircuitOpenError(OutboundError):
+    def __init__(self, provider: str, operation: str):
+        super().__init__(provider, operation, "circuit_open", "too many recent failures, not calling")
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(error, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(error: BaseException) -> str:
+    if isinstance(error, OutboundError):
+        return error.kind
+    status = _status_code(error)
+    name = type(error).__name__
+    message = str(error).lower()
+    if status == 429 or name in _RATE_LIMIT_NAMES or "too many requests" in message or "rate limit" in message or "quota" in message:
+        return "rate_limited"
+    if (status is not None and status >= 500) or name in _TRANSIENT_NAMES:
+        return "transient"
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return "transient"
+    if status is not None and 400 <= status < 500:
+        return "client"
+    return "unknown"
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return float(headers.get("Retry-After")) if headers is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full jitter: uniform in [0, min(cap, base * 2^attempt)], but never sooner than Retry-After."""
+    ceiling = min(settings.OUTBOUND_BACKOFF_MAX_SECONDS, settings.OUTBOUND_BACKOFF_BASE_SECONDS * 2 ** attempt)
+    delay = random.uniform(0, ceiling)
+    return max(delay, retry_after) if retry_after else delay
+
+
+# 1. Token buckets
+class MemoryBucketStore:
+    """Per-process buckets, used when no shared limiter file is configured."""
+
+    def __init__(self):
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, provider: str, max_rate: float, burst: float) -> Tuple[float, float]:
+        """Takes a token if one is available. Returns (seconds to wait, 0 if taken; current rate)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at, rate = self._buckets.setdefault(provider, [burst, now, max_rate])
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[provider] = [tokens - 1 if wait == 0 else tokens, now, rate]
+            return wait, rate
+
+    def set_rate(self, provider: str, rate: float, drain: bool = False):
+        with self._lock:
+            bucket = self._buckets.get(provider)
+            if bucket:
+                bucket[2] = rate
+                if drain:
+                    bucket[0] = 0.0
+
+
+class SQLiteBucketStore:
+    """Buckets in a SQLite file so every worker process on the host draws from the same quota."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "provider TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, rate REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def try_acquire(self, provider: str, max_rate: float, burst: float) -> Tuple[float, float]:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            # IMMEDIATE takes the write lock up front, so read-refill-take is atomic across processes
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated_at, rate FROM buckets WHERE provider = ?", (provider,)).fetchone()
+                tokens, updated_at, rate = row if row else (burst, now, max_rate)
+                rate = min(rate, max_rate)
+                tokens = min(burst, tokens + max(0.0, now - updated_at) * rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (provider, tokens, updated_at, rate) VALUES (?, ?, ?, ?)",
+                    (provider, tokens - 1 if wait == 0 else tokens, now, rate),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return wait, rate
+
+    def set_rate(self, provider: str, rate: float, drain: bool = False):
+        with closing(self._connect()) as conn:
+            if drain:
+                conn.execute("UPDATE buckets SET rate = ?, tokens = 0, updated_at = ? WHERE provider = ?",
+                             (rate, time.time(), provider))
+            else:
+                conn.execute("UPDATE buckets SET rate = ? WHERE provider = ?", (rate, provider))
+
+
+class RateLimiter:
+    """AIMD on top of a bucket store: halve the rate on a 429, step back up on success."""
+
+    def __init__(self, store):
+        self.store = store
+        self._rates: Dict[str, float] = {}
+
+    def _limits(self, provider: str) -> Tuple[float, float]:
+        max_rate = settings.OUTBOUND_RATE_LIMITS.get(provider, settings.OUTBOUND_DEFAULT_RATE)
+        return max_rate, max(1.0, max_rate * settings.OUTBOUND_BURST_SECONDS)
+
+    def try_acquire(self, provider: str) -> float:
+        max_rate, burst = self._limits(provider)
+        wait, self._rates[provider] = self.store.try_acquire(provider, max_rate, burst)
+        return wait
+
+    def acquire_sync(self, provider: str):
+        while True:
+            wait = self.try_acquire(provider)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire(self, provider: str):
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, provider)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def throttle(self, provider: str):
+        max_rate, _ = self._limits(provider)
+        rate = max(max_rate * MIN_RATE_FRACTION, self._rates.get(provider, max_rate) / 2)
+        self._rates[provider] = rate
+        self.store.set_rate(provider, rate, drain=True)
+        print(f"Outbound {provider}: rate limited, slowing to {rate:.2f} req/s")
+
+    def recover(self, provider: str):
+        max_rate, _ = self._limits(provider)
+        rate = self._rates.get(provider, max_rate)
+        if rate < max_rate:
+            rate = min(max_rate, rate + max_rate * RECOVERY_STEP_FRACTION)
+            self._rates[provider] = rate
+            self.store.set_rate(provider, rate)
+
+
+# 2. Circuit breakers
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; lets one probe through after `reset_seconds`."""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing else "open"
+
+    def allow(self) -> Optional[str]:
+        """"closed" or "probe" when the call may go ahead, None while the circuit is open."""
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.probing = True
+                return "probe"
+            return None
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def abandon_probe(self):
+        """A probe that ended without an answer (cancelled, interrupted) reopens the circuit."""
+        with self._lock:
+            if self.probing:
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+_limiter: Optional[RateLimiter] = None
+_breakers: Dict[str, CircuitBreaker] = {}
+_state_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    with _state_lock:
+        if _limiter is None:
+            store = MemoryBucketStore()
+            if settings.OUTBOUND_LIMITER_PATH:
+                directory = os.path.dirname(settings.OUTBOUND_LIMITER_PATH)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                store = SQLiteBucketStore(settings.OUTBOUND_LIMITER_PATH)
+            _limiter = RateLimiter(store)
+        return _limiter
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    with _state_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(settings.OUTBOUND_BREAKER_FAILURES, settings.OUTBOUND_BREAKER_RESET_SECONDS)
+        return _breakers[provider]
+
+
+def breaker_states() -> Dict[str, str]:
+    with _state_lock:
+        return {provider: breaker.state for provider, breaker in _breakers.items()}
+
+
+# 3. Calls
+def _on_failure(provider: str, operation: str, error: BaseException, attempt: int) -> Tuple[str, bool]:
+    """Updates breaker and limiter for a failed attempt; returns (kind, should retry)."""
+    kind = classify_error(error)
+    if kind in RETRYABLE:
+        get_breaker(provider).record_failure()
+    else:
+        # The provider answered (e.g. a 404 or an unparsable reply), so it is reachable
+        get_breaker(provider).record_success()
+    if kind == "rate_limited":
+        get_rate_limiter().throttle(provider)
+    retry = kind in RETRYABLE and attempt < settings.OUTBOUND_MAX_ATTEMPTS - 1
+    if retry:
+        OUTBOUND_RETRIES.labels(provider, kind).inc()
+        print(f"Outbound {provider} {operation}: {kind} error on attempt {attempt + 1}, retrying: {error}")
+    return kind, retry
+
+
+def _on_success(provider: str):
+    get_breaker(provider).record_success()
+    get_rate_limiter().recover(provider)
+
+
+def _check_breaker(provider: str, operation: str) -> bool:
+    """Raises CircuitOpenError while the circuit is open; returns True if this call is the half-open probe."""
+    grant = get_breaker(provider).allow()
+    if grant is None:
+        OUTBOUND_REJECTED.labels(provider).inc()
+        raise CircuitOpenError(provider, operation)
+    return grant == "probe"
+
+
+async def _hedged(provider: str, factory: Callable[[], Awaitable[Any]], hedge_after: float):
+    """Starts a second request if the first has not answered after `hedge_after` seconds and a token is free."""
+    tasks = [asyncio.ensure_future(factory())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done and await asyncio.to_thread(get_rate_limiter().try_acquire, provider) <= 0:
+            OUTBOUND_HEDGES.labels(provider).inc()
+            tasks.append(asyncio.ensure_future(factory()))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+        return tasks[0].result()  # every request failed: surface the original one's error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def call(provider: str, operation: str, factory: Callable[[], Awaitable[Any]],
+               hedge_after: Optional[float] = None):
+    """
+    Awaits `factory()` under the provider's rate limit, breaker and retry policy. `factory`
+    must create a new awaitable on every call. `hedge_after` enables hedging.
+    """
+    limiter = get_rate_limiter()
+    for attempt in range(settings.OUTBOUND_MAX_ATTEMPTS):
+        probe = _check_breaker(provider, operation)
+        try:
+            await limiter.acquire(provider)
+            try:
+                with track_external_call(provider, operation):
+                    if hedge_after:
+                        result = await _hedged(provider, factory, hedge_after)
+                    else:
+                        result = await factory()
+            except Exception as e:
+                kind, retry = _on_failure(provider, operation, e, attempt)
+                if not retry:
+                    raise OutboundError(provider, operation, kind, e) from e
+                await asyncio.sleep(backoff_delay(attempt, _retry_after(e)))
+                continue
+        except BaseException:
+            # CancelledError skips the handler above; without this a cancelled probe would hold the circuit half-open
+            if probe:
+                get_breaker(provider).abandon_probe()
+            raise
+        _on_success(provider)
+        return result
+
+
+def call_sync(provider: str, operation: str, func: Callable[[], Any]):
+    """Blocking counterpart of `call` for code running in worker threads (e.g. yfinance)."""
+    limiter = get_rate_limiter()
+    for attempt in range(settings.OUTBOUND_MAX_ATTEMPTS):
+        probe = _check_breaker(provider, operation)
+        try:
+            limiter.acquire_sync(provider)
+            try:
+                with track_external_call(provider, operation):
+                    result = func()
+            except Exception as e:
+                kind, retry = _on_failure(provider, operation, e, attempt)
+                if not retry:
+                    raise OutboundError(provider, operation, kind, e) from e
+                time.sleep(backoff_delay(attempt, _retry_after(e)))
+                continue
+        except BaseException:
+            if probe:
+                get_breaker(provider).abandon_probe()
+            raise
+        _on_success(provider)
+        return result
@@ -1,5 +1,5 @@
 import enum
-from sqlalchemy import (Column, Integer, String, DateTime, ForeignKey, Enum, JSON, Text)
+from sqlalchemy import (Column, Integer, String, Date, DateTime, ForeignKey, Enum, JSON, Text, Index, text)
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
@@ -48,14 +48,57 @@ class Company(Base):
     country = relationship("Country", back_populates="companies")
     analyses = relationship("AnalysisLog", back_populates="company")
 
+class CompanyRequestCount(Base):
+    # Analysis requests per company and UTC day, cache hits included; the scheduler warms the most requested
+    __tablename__ = "company_request_counts"
+    company_id = Column(Integer, ForeignKey("companies.id"), primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    count = Column(Integer, nullable=False, default=0)
+
+# Stand-alone analyses that are queued or running; there is at most one per company
+INFLIGHT_ANALYSIS = text("status IN ('pending', 'running') AND batch_id IS NULL")
+
 class AnalysisLog(Base):
     __tablename__ = "analysis_logs"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     session_id = Column(String(255), nullable=True)
     company_id = Column(Integer, ForeignKey("companies.id"))
+    batch_id = Column(Integer, ForeignKey("analysis_batches.id"), nullable=True, index=True)
     result_json = Column(JSON, nullable=True)
-    status = Column(String(20), default='pending') # pending, completed, failed
+    progress_json = Column(JSON, nullable=True) # output of each finished graph node
+    intermediate_json = Column(JSON, nullable=True) # graph intermediates with content hashes, for incremental re-runs
+    status = Column(String(20), default='pending') # pending, running, completed, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    worker_id = Column(String(100), nullable=True)
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    error = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     user = relationship("User", back_populates="analyses")
-    company = relationship("Company", back_populates="analyses")
\ No newline at end of file
+    company = relationship("Company", back_populates="analyses")
+    batch = relationship("AnalysisBatch", back_populates="analyses")
+
+    # Keyset pagination for the history endpoints: newest first on (created_at, id), per filter
+    __table_args__ = (
+        Index("ix_analysis_logs_created_at_id", "created_at", "id"),
+        Index("ix_analysis_logs_user_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_analysis_logs_company_created_at_id", "company_id", "created_at", "id"),
+        Index("ix_analysis_logs_status_created_at_id", "status", "created_at", "id"),
+        # Single-flight: concurrent requests for a ticker race on this index instead of each queueing a job
+        Index("uq_analysis_logs_inflight_company", "company_id", unique=True,
+              postgresql_where=INFLIGHT_ANALYSIS, sqlite_where=INFLIGHT_ANALYSIS),
+    )
+
+class AnalysisBatch(Base):
+    __tablename__ = "analysis_batches"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    status = Column(String(20), default='pending') # pending, running, completed, partial, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    worker_id = Column(String(100), nullable=True)
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    analyses = relationship("AnalysisLog", back_populates="batch")
\ No newline at end of file
@@ -1,8 +1,37 @@
-from fastapi import FastAPI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from app.api import auth, companies, analysis
+from app.core.http import close_http_client
+from app.core.loop_monitor import loop_monitor
+from app.core.metrics import HTTP_REQUEST_DURATION, render_metrics
+from app.core.security import PasswordHasherBusy, password_hasher
+from app.db.session import async_engine
+from app.services.fundamentals import fundamentals
+from app.services.request_counts import request_counter
+from app.services.ticker_index import ticker_index
 
-app = FastAPI(title="AI Investment Advisor")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_monitor.start()
+    ticker_index.start()
+    fundamentals.start()
+    request_counter.start()
+    yield
+    await request_counter.stop()
+    await fundamentals.stop()
+    await ticker_index.stop()
+    await loop_monitor.stop()
+    await close_http_client()
+    await async_engine.dispose()
+    password_hasher.shutdown()
+
+
+app = FastAPI(title="AI Investment Advisor", lifespan=lifespan)
 
 # CORS middleware
 origins = [
@@ -16,6 +45,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template, not raw path, so /analysis-status/{analysis_id} stays one series
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    HTTP_REQUEST_DURATION.labels(request.method, path, response.status_code).observe(time.perf_counter() - started)
+    return response
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "Server is busy, please retry"}, headers={"Retry-After": "1"})
+
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(companies.router, prefix="/api/data", tags=["Company Data"])
@@ -23,4 +66,18 @@ app.include_router(analysis.router, prefix="/api/analysis", tags=["AI Analysis"]
 
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to the AI Investment Advisor API"}
\ No newline at end of file
+    return {"message": "Welcome to the AI Investment Advisor API"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # The queue collector queries the database; keep that off the event loop
+    body, content_type = await asyncio.to_thread(render_metrics)
+    return Response(content=body, media_type=content_type)
+
+@app.get("/health")
+def health():
+    return {
+        "event_loop": loop_monitor.stats(),
+        "db_pool": async_engine.pool.status(),
+        "password_hasher": {"pending": password_hasher.pending, "max_pending": password_hasher.max_pending},
+    }
@@ -0,0 +1,229 @@
+"""
+Cache-warming scheduler. Keeps the most requested tickers warm so users hit the result
+cache instead of the cold path (yfinance, Tavily, three LLM calls).
+
+    python -m app.scheduler [--once]
+
+Every SCHEDULER_INTERVAL_SECONDS, inside the SCHEDULER_WINDOWS hours, it:
+  1. prefetches market data for the SCHEDULER_TOP_TICKERS most requested companies
+     into the shared disk cache,
+  2. enqueues analyses for those whose latest result would expire before the next pass.
+     The workers run them like any other job; the result cache then serves them.
+  3. backfills market data for up to FUNDAMENTALS_BACKFILL_TICKERS companies that have
+     none at all, so the screener, which reads the cache, covers them too.
+
+All steps draw on per-window budgets (backfill on what step 1 left of the market-data
+one), and at most SCHEDULER_MAX_CONCURRENT warming analyses are queued or running at once. Run a single scheduler per deployment.
+"""
+import argparse
+import signal
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Set, Tuple
+
+import pytz
+from sqlalchemy import func
+
+from app.core.config import settings
+from app.db import models
+from app.db.session import SessionLocal
+from app.services.analysis_jobs import enqueue_statement
+from app.services.market_data import get_market_data_provider
+
+SCHEDULER_SESSION_ID = "scheduler"
+# Backfilled tickers yfinance had nothing for; not retried until the scheduler restarts
+_backfill_attempted: Set[str] = set()
+
+
+def _now():
+    return datetime.now(pytz.utc)
+
+
+def in_window(now: datetime, windows: str) -> bool:
+    """True if the UTC hour falls in one of the comma-separated "start-end" ranges; ranges may wrap midnight."""
+    if not windows.strip():
+        return True
+    for window in windows.split(","):
+        start, _, end = window.strip().partition("-")
+        start, end = int(start), int(end or 24)
+        if start <= end and start <= now.hour < end:
+            return True
+        if start > end and (now.hour >= start or now.hour < end):
+            return True
+    return False
+
+
+class Budget:
+    """Call allowances that reset every `window_seconds`."""
+
+    def __init__(self, window_seconds: int, limits: Dict[str, int]):
+        self.window_seconds = window_seconds
+        self.limits = limits
+        self.spent = {kind: 0 for kind in limits}
+        self.window_started = time.monotonic()
+
+    def _roll(self):
+        if time.monotonic() - self.window_started >= self.window_seconds:
+            self.spent = {kind: 0 for kind in self.limits}
+            self.window_started = time.monotonic()
+
+    def remaining(self, kind: str) -> int:
+        self._roll()
+        return max(0, self.limits[kind] - self.spent[kind])
+
+    def spend(self, kind: str, amount: int):
+        self.spent[kind] += amount
+
+
+def popular_companies(db, limit: int) -> List[Tuple[int, str]]:
+    """(company id, ticker) of the companies with the most requests over the last SCHEDULER_POPULARITY_DAYS."""
+    since = (_now() - timedelta(days=settings.SCHEDULER_POPULARITY_DAYS)).date()
+    counts = models.CompanyRequestCount
+    requests = func.sum(counts.count)
+    rows = db.query(models.Company.id, models.Company.ticker_symbol).join(
+        counts, counts.company_id == models.Company.id
+    ).filter(
+        models.Company.ticker_symbol.isnot(None),
+        counts.day >= since,
+    ).group_by(models.Company.id, models.Company.ticker_symbol).order_by(
+        requests.desc(), models.Company.id
+    ).limit(limit).all()
+    return [(row.id, row.ticker_symbol) for row in rows]
+
+
+def companies_due(db, company_ids: List[int]) -> Set[int]:
+    """Companies with no analysis in flight whose latest result is missing or expires before the next pass."""
+    if not company_ids:
+        return set()
+    log = models.AnalysisLog
+    inflight = {row.company_id for row in db.query(log.company_id).filter(
+        log.company_id.in_(company_ids), log.status.in_(['pending', 'running'])
+    ).distinct()}
+    refresh_before = _now() - timedelta(seconds=max(
+        0, settings.ANALYSIS_CACHE_TTL_SECONDS - settings.SCHEDULER_INTERVAL_SECONDS - settings.SCHEDULER_REFRESH_LEAD_SECONDS
+    ))
+    latest = dict(db.query(log.company_id, func.max(log.updated_at)).filter(
+        log.company_id.in_(company_ids), log.status == 'completed'
+    ).group_by(log.company_id).all())
+    due = set()
+    for company_id in company_ids:
+        if company_id in inflight:
+            continue
+        finished = latest.get(company_id)
+        if finished is not None and finished.tzinfo is None:
+            finished = finished.replace(tzinfo=pytz.utc)
+        if finished is None or finished < refresh_before:
+            due.add(company_id)
+    return due
+
+
+def active_warming_jobs(db) -> int:
+    return db.query(func.count(models.AnalysisLog.id)).filter(
+        models.AnalysisLog.session_id == SCHEDULER_SESSION_ID,
+        models.AnalysisLog.status.in_(['pending', 'running']),
+    ).scalar() or 0
+
+
+def backfill_candidates(db, disk_store, limit: int) -> List[str]:
+    """Tickers of companies, oldest first, with no cached quote info at all."""
+    tickers = [ticker.upper() for (ticker,) in db.query(models.Company.ticker_symbol).filter(
+        models.Company.ticker_symbol.isnot(None)
+    ).order_by(models.Company.id)]
+    return disk_store.missing("info", [ticker for ticker in tickers if ticker not in _backfill_attempted])[:limit]
+
+
+def warm_popular(db, budget: Budget):
+    popular = popular_companies(db, settings.SCHEDULER_TOP_TICKERS)
+    if not popular:
+        return
+
+    # 1. Market data: only tickers missing from the cache are fetched, and only those count
+    provider = get_market_data_provider()
+    allowed = budget.remaining("market_data")
+    if allowed and hasattr(provider, "prefetch"):
+        fetched = provider.prefetch([ticker for _, ticker in popular[:allowed]])
+        budget.spend("market_data", max(fetched.values(), default=0))
+        print(f"Scheduler prefetched market data: {fetched}")
+
+    # 2. Analyses, most requested first, within the concurrency and window budgets
+    due = companies_due(db, [company_id for company_id, _ in popular])
+    slots = min(settings.SCHEDULER_MAX_CONCURRENT - active_warming_jobs(db), budget.remaining("analyses"))
+    queued = []
+    for company_id, ticker in popular:
+        if len(queued) >= slots:
+            break
+        if company_id in due:
+            # A user request may have queued one since companies_due looked
+            inserted = db.execute(enqueue_statement(db.get_bind().dialect.name, company_id, SCHEDULER_SESSION_ID))
+            if inserted.rowcount:
+                queued.append(ticker)
+    db.commit()
+    budget.spend("analyses", len(queued))
+    if queued:
+        print(f"Scheduler queued warming analyses for {', '.join(queued)} "
+              f"({budget.remaining('analyses')} left in this window)")
+
+
+def backfill_fundamentals(db, budget: Budget):
+    # 3. Backfill, after the popular tickers have had their share of the market-data budget
+    provider = get_market_data_provider()
+    disk_store = getattr(provider, "disk_store", None)
+    allowed = min(settings.FUNDAMENTALS_BACKFILL_TICKERS, budget.remaining("market_data"))
+    if not allowed or disk_store is None:
+        return
+    tickers = backfill_candidates(db, disk_store, allowed)
+    if not tickers:
+        return
+    _backfill_attempted.update(tickers)
+    fetched = provider.prefetch(tickers)
+    budget.spend("market_data", max(fetched.values(), default=0))
+    print(f"Scheduler backfilled market data for {len(tickers)} companies: {fetched}")
+
+
+def warm_once(budget: Budget):
+    if not in_window(_now(), settings.SCHEDULER_WINDOWS):
+        return
+    db = SessionLocal()
+    try:
+        warm_popular(db, budget)
+        backfill_fundamentals(db, budget)
+    finally:
+        db.close()
+
+
+def scheduler_loop(once: bool = False):
+    budget = Budget(settings.SCHEDULER_BUDGET_WINDOW_SECONDS, {
+        "analyses": settings.SCHEDULER_ANALYSES_PER_WINDOW,
+        "market_data": settings.SCHEDULER_MARKET_DATA_PER_WINDOW,
+    })
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    print(f"Scheduler started (windows: {settings.SCHEDULER_WINDOWS or 'always'})")
+    while not stopping:
+        try:
+            warm_once(budget)
+        except Exception as e:
+            print(f"Scheduler pass failed: {e}")
+        if once:
+            break
+        deadline = time.monotonic() + settings.SCHEDULER_INTERVAL_SECONDS
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm caches for popular tickers")
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit, e.g. from cron (budgets then apply per pass)")
+    args = parser.parse_args()
+    scheduler_loop(args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -41,4 +41,23 @@ class AnalysisResponse(BaseModel):
         from_attributes = True
         json_encoders = {
             dict: lambda v: v.get('result_json') if v and 'result_json' in v else v
-        }
\ No newline at end of file
+        }
+
+class BatchAnalysisRequest(BaseModel):
+    tickers: List[str] = Field(..., min_length=1)
+
+class AnalysisHistoryItem(BaseModel):
+    id: int
+    company_id: int
+    ticker: Optional[str] = None
+    user_id: Optional[int] = None
+    batch_id: Optional[int] = None
+    status: str
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    result: Optional[Dict[str, Any]] = None
+
+class AnalysisHistoryPage(BaseModel):
+    items: List[AnalysisHistoryItem]
+    next_cursor: Optional[str] = None
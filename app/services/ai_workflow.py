@@ -1,22 +1,75 @@
-import yfinance as yf
-# from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
+import asyncio
+import hashlib
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
-# from langchain.tools.tavily_search import TavilySearchResults
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langgraph.graph import StateGraph, END,add_messages
-from typing import TypedDict, List, Dict, Any
+from langgraph.graph import StateGraph, END
+from typing import TypedDict, List, Dict, Any, Awaitable, Callable, Optional
 from app.core.config import settings
+from app.core.metrics import STEPS_REUSED, instrument_node
+from app.core.outbound import call
+from app.services.market_data import get_market_data_provider
+from app.services.llm import StructuredChain
+from app.services.news_context import build_news_context
+from app.services.fundamentals import fundamentals
 from typing import Annotated
 
 
 # 1. Define Agent Tools
-# tavily_tool = TavilySearchResults(max_results=4, api_key=settings.TAVILY_API_KEY)
-tavily_tool = TavilySearchResults(
-    max_results=4,
-    tavily_api_key=settings.TAVILY_API_KEY  # 👈 correct name
-)
+# Built on first use: langchain_community is slow to import and only analyses need it
+tavily_tool = None
+_tool_lock = threading.Lock()
+
+def get_search_tool():
+    global tavily_tool
+    with _tool_lock:
+        if tavily_tool is None:
+            from langchain_community.tools.tavily_search import TavilySearchResults
+            tavily_tool = TavilySearchResults(
+                max_results=4,
+                tavily_api_key=settings.TAVILY_API_KEY  # 👈 correct name
+            )
+        return tavily_tool
+
+def set_search_tool(tool):
+    """Replaces the news search tool, e.g. with an offline fake in benchmarks."""
+    global tavily_tool
+    with _tool_lock:
+        tavily_tool = tool
+
+class SearchError(Exception):
+    """A failed Tavily request, carrying its HTTP status so the outbound layer can classify it."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+_SEARCH_ERROR = re.compile(r"Error (\d{3}):")
+
+async def search_news(query: str) -> List[Dict[str, Any]]:
+    tool = get_search_tool()
+
+    async def fetch():
+        # The tool returns any failure as a string result; its API wrapper raises it, so call() can retry
+        try:
+            return await tool.api_wrapper.results_async(query, tool.max_results)
+        except Exception as e:
+            match = _SEARCH_ERROR.match(str(e))
+            if match:
+                raise SearchError(int(match.group(1)), str(e)) from e
+            raise
+
+    return await call("tavily", "search", fetch)
+
+# Market data fetches are blocking; keep them off the event loop in a bounded pool
+market_data_executor = ThreadPoolExecutor(max_workers=settings.YFINANCE_MAX_WORKERS, thread_name_prefix="market-data")
+
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(market_data_executor, func, *args)
 
 # 2. Define Output Schemas
 class FinancialAnalysis(BaseModel):
@@ -24,6 +77,10 @@ class FinancialAnalysis(BaseModel):
     key_metrics: Dict[str, Any] = Field(description="Key financial metrics like P/E Ratio, Debt-to-Equity, Revenue Growth (YoY), etc.")
     recent_performance: str = Field(description="A summary of the company's recent financial performance based on earnings reports and stock price.")
 
+class PerformanceSummary(BaseModel):
+    """Summary of a company's recent financial performance."""
+    recent_performance: str = Field(description="A summary of the company's recent financial performance based on earnings reports and stock price.")
+
 class MarketAnalysis(BaseModel):
     """Structured market analysis of a company."""
     industry_trends: List[str] = Field(description="Major trends in the company's industry.")
@@ -40,106 +97,321 @@ class FinalReport(BaseModel):
     recommendation_summary: str = Field(description="A 1-2 sentence justification for the final recommendation.")
 
 # 3. Define Graph State
+def merge_dicts(left: Optional[Dict[str, Any]], right: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # The two analysts run in parallel and both record their step and usage
+    return {**(left or {}), **(right or {})}
+
 class AgentState(TypedDict):
     company_ticker: str
     financial_data: Dict[str, Any]
     news_and_filings: str
-    # financial_analysis_result: FinancialAnalysis
-    # market_analysis_result: MarketAnalysis
-    financial_analysis_result: Annotated[List, add_messages]   # 👈 allows multiple writes
-    market_analysis_result: Annotated[List, add_messages]
+    news_context: Dict[str, Any]  # dedupe/packing stats per prompt
+    financial_analysis_result: FinancialAnalysis
+    market_analysis_result: MarketAnalysis
     final_report: FinalReport
+    # Steps recorded by the last completed run for this ticker, and by this run:
+    # {step: {"hash": content hash, "value": ..., "input_hash": hash of the step's declared inputs (LLM steps only)}}
+    previous_intermediates: Dict[str, Any]
+    intermediates: Annotated[Dict[str, Any], merge_dicts]
+    # {node: model, tokens, cost_usd, seconds, cached/escalated/reused} for each LLM node
+    llm_usage: Annotated[Dict[str, Any], merge_dicts]
 
 # 4. Define Agent Nodes
-def data_collection_node(state: AgentState):
+async def data_collection_node(state: AgentState):
     print("--- AGENT: Data Collector ---")
     ticker = state["company_ticker"]
-    stock = yf.Ticker(ticker)
-    info = stock.info
-    financials = stock.financials
-    
+    market_data = get_market_data_provider()
+    # Quote info, statements and news are independent; fetch them at the same time
+    info, financials, search_results = await asyncio.gather(
+        run_blocking(market_data.get_info, ticker),
+        run_blocking(market_data.get_financials, ticker),
+        search_news(f"latest news and SEC filings for {ticker}"),
+    )
+
     financial_data = {
         "market_cap": info.get("marketCap"),
         "pe_ratio": info.get("trailingPE"),
         "forward_pe": info.get("forwardPE"),
         "revenue_growth": info.get("revenueGrowth"),
         "debt_to_equity": info.get("debtToEquity"),
-        "recent_revenue": financials.loc['Total Revenue'].to_dict() if not financials.empty else {},
+        "recent_revenue": financials.get("Total Revenue", {}),
+    }
+    # Growth, CAGR, margins and leverage from the same vectorized code the screener uses
+    fundamentals.record(ticker, info, financials)
+    financial_data["derived_metrics"] = await run_blocking(fundamentals.metrics_for, ticker)
+    # Deduplicated, ranked and cut to the market analyst's token budget instead of every snippet verbatim
+    company_name = info.get("longName") or info.get("shortName")
+    news_and_filings, market_stats = build_news_context(
+        search_results, ticker, settings.NEWS_CONTEXT_MARKET_TOKENS, company_name, prompt="market_analyst"
+    )
+    news_context = {"market_analyst": market_stats}
+    print(f"News context for {ticker}: saved {market_stats['tokens_saved']} tokens")
+    intermediates = {
+        "financial_data": {"hash": content_hash(financial_data), "value": financial_data},
+        "news_and_filings": {"hash": content_hash(news_and_filings), "value": news_and_filings},
     }
-    search_results = tavily_tool.invoke(f"latest news and SEC filings for {ticker}")
-    news_and_filings = "\n".join([res["content"] for res in search_results])
     
-    return {"financial_data": financial_data, "news_and_filings": news_and_filings}
+    return {"financial_data": financial_data, "news_and_filings": news_and_filings,
+            "news_context": news_context, "intermediates": intermediates}
 
-def financial_analyst_node(state: AgentState):
-    print("--- AGENT: Financial Analyst ---")
-    # llm = ChatOpenAI(model="gpt-4-turbo", openai_api_key=settings.OPENAI_API_KEY)
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro-latest", google_api_key=settings.GOOGLE_API_KEY)
-    structured_llm = llm.with_structured_output(FinancialAnalysis)
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are an expert financial analyst. Analyze the provided data and generate a structured financial report."),
-        ("human", "Here is the financial data for {company_ticker}:\n\n{financial_data}\n\nAnd recent news/filings:\n\n{news_and_filings}\n\nPlease provide your analysis."),
-    ])
-    chain = prompt | structured_llm
-    result = chain.invoke(state)
-    return {"financial_analysis_result": result}
-
-def market_analyst_node(state: AgentState):
-    print("--- AGENT: Market Analyst ---")
-    # llm = ChatOpenAI(model="gpt-4-turbo", openai_api_key=settings.OPENAI_API_KEY)
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro-latest", google_api_key=settings.GOOGLE_API_KEY)
-    structured_llm = llm.with_structured_output(MarketAnalysis)
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are an expert market analyst. Analyze the company's market position based on recent news and trends."),
-        ("human", "Company: {company_ticker}\n\nRecent News:\n\n{news_and_filings}\n\nPlease provide a structured market analysis."),
-    ])
-    chain = prompt | structured_llm
-    result = chain.invoke(state)
-    return {"market_analysis_result": result}
-
-def final_advisor_node(state: AgentState):
-    print("--- AGENT: Final Advisor ---")
-    # llm = ChatOpenAI(model="gpt-4-turbo", openai_api_key=settings.OPENAI_API_KEY)
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro-latest", google_api_key=settings.GOOGLE_API_KEY)
-    structured_llm = llm.with_structured_output(FinalReport)
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a senior investment advisor. Synthesize the financial and market analyses to create a final investment report with a clear recommendation."),
-        ("human", """
+def key_metrics_from_data(financial_data: Dict[str, Any]) -> Dict[str, Any]:
+    """FinancialAnalysis.key_metrics read straight from the collected quote info and derived metrics."""
+    derived = financial_data.get("derived_metrics") or {}
+
+    def first(*values):
+        return next((value for value in values if value is not None), None)
+
+    debt_to_equity = financial_data.get("debt_to_equity")
+    metrics = {
+        "Market Cap": first(financial_data.get("market_cap"), derived.get("market_cap")),
+        "P/E Ratio": first(financial_data.get("pe_ratio"), derived.get("pe_ratio")),
+        "Forward P/E": first(financial_data.get("forward_pe"), derived.get("forward_pe")),
+        "Price-to-Sales": derived.get("price_to_sales"),
+        "Revenue Growth (YoY)": first(derived.get("revenue_growth_yoy"), financial_data.get("revenue_growth")),
+        "Revenue CAGR": derived.get("revenue_cagr"),
+        "Net Income Growth (YoY)": derived.get("net_income_growth_yoy"),
+        "Gross Margin": derived.get("gross_margin"),
+        "Operating Margin": derived.get("operating_margin"),
+        "Net Margin": derived.get("net_margin"),
+        # yfinance reports debt/equity in percent
+        "Debt-to-Equity": first(derived.get("debt_to_equity"), debt_to_equity / 100 if debt_to_equity is not None else None),
+    }
+    return {label: round(value, 4) if isinstance(value, float) else value
+            for label, value in metrics.items() if value is not None}
+
+# Prompts and clients are built once per process and reused by every analysis.
+# Each chain runs on LLM_NODE_MODELS[node] (the analysts default to the fast tier).
+financial_analyst_prompt = ChatPromptTemplate.from_messages([
+    ("system", "You are an expert financial analyst. Analyze the provided data and generate a structured financial report."),
+    # News goes to the market analyst only, so this step reruns only when the financial data changes
+    ("human", "Here is the financial data for {company_ticker}:\n\n{financial_data}\n\nPlease provide your analysis."),
+])
+
+financial_analyst_chain = StructuredChain("financial_analyst", FinancialAnalysis, financial_analyst_prompt)
+
+# Used instead when FINANCIAL_KEY_METRICS_FROM_DATA: the model only writes the narrative
+financial_summary_chain = StructuredChain("financial_analyst", PerformanceSummary, financial_analyst_prompt)
+
+market_analyst_chain = StructuredChain("market_analyst", MarketAnalysis, ChatPromptTemplate.from_messages([
+    ("system", "You are an expert market analyst. Analyze the company's market position based on recent news and trends."),
+    ("human", "Company: {company_ticker}\n\nRecent News:\n\n{news_and_filings}\n\nPlease provide a structured market analysis."),
+]))
+
+final_advisor_chain = StructuredChain("final_advisor", FinalReport, ChatPromptTemplate.from_messages([
+    ("system", "You are a senior investment advisor. Synthesize the financial and market analyses to create a final investment report with a clear recommendation."),
+    ("human", """
         Company Ticker: {company_ticker}
         Financial Analysis:\n- Key Metrics: {financial_metrics}\n- Performance Summary: {performance_summary}
         Market Analysis:\n- Industry Trends: {industry_trends}\n- Competitive Landscape: {competitive_landscape}
         Based on all this information, generate the final report.
         """),
-    ])
-    chain = prompt | structured_llm
+]))
+
+# What each LLM step is a function of: intermediates recorded earlier in the same run
+STEP_INPUTS = {
+    "financial_analysis": ["financial_data"],
+    "financial_summary": ["financial_data"],
+    "market_analysis": ["news_and_filings"],
+    "final_report": ["financial_analysis", "market_analysis"],
+}
+
+def step_input_hash(state: AgentState, step: str, chain: StructuredChain) -> str:
+    """Hash of the ticker, the chain's model, schema and prompt, and the content hashes of the step's inputs."""
+    recorded = state.get("intermediates") or {}
+    return content_hash({
+        "company_ticker": state["company_ticker"],
+        "chain": chain.fingerprint,
+        "inputs": {name: recorded[name]["hash"] for name in STEP_INPUTS[step]},
+    })
+
+async def run_or_reuse(state: AgentState, step: str, chain: StructuredChain, inputs: Dict[str, Any]):
+    """
+    Runs `chain` unless the previous run recorded this step with the same input hash, in
+    which case its stored output is reused. Returns the result and a state update with the
+    step's record and the node's LLM usage.
+    """
+    input_hash = step_input_hash(state, step, chain)
+    previous = (state.get("previous_intermediates") or {}).get(step)
+    if previous and previous.get("input_hash") == input_hash:
+        print(f"--- Reusing {step} from the previous run ---")
+        STEPS_REUSED.labels(step).inc()
+        result = chain.schema.parse_obj(previous["value"])
+        usage = {"reused": True, "cost_usd": 0.0, "seconds": 0.0}
+    else:
+        usage = {"reused": False}
+        result = await chain.ainvoke(inputs, usage)
+    value = result.dict()
+    return result, {
+        "intermediates": {step: {"hash": content_hash(value), "input_hash": input_hash, "value": value}},
+        "llm_usage": {chain.name: usage},
+    }
+
+async def financial_analyst_node(state: AgentState):
+    print("--- AGENT: Financial Analyst ---")
+    if not settings.FINANCIAL_KEY_METRICS_FROM_DATA:
+        result, update = await run_or_reuse(state, "financial_analysis", financial_analyst_chain, state)
+        return {"financial_analysis_result": result, **update}
+    summary, update = await run_or_reuse(state, "financial_summary", financial_summary_chain, state)
+    result = FinancialAnalysis(
+        key_metrics=key_metrics_from_data(state["financial_data"]),
+        recent_performance=summary.recent_performance,
+    )
+    value = result.dict()
+    update["intermediates"]["financial_analysis"] = {"hash": content_hash(value), "value": value}
+    return {"financial_analysis_result": result, **update}
+
+async def market_analyst_node(state: AgentState):
+    print("--- AGENT: Market Analyst ---")
+    result, update = await run_or_reuse(state, "market_analysis", market_analyst_chain, state)
+    return {"market_analysis_result": result, **update}
+
+async def final_advisor_node(state: AgentState):
+    print("--- AGENT: Final Advisor ---")
     financial_analysis = state['financial_analysis_result']
     market_analysis = state['market_analysis_result']
-    result = chain.invoke({
+    result, update = await run_or_reuse(state, "final_report", final_advisor_chain, {
         "company_ticker": state['company_ticker'],
         "financial_metrics": financial_analysis.key_metrics,
         "performance_summary": financial_analysis.recent_performance,
         "industry_trends": market_analysis.industry_trends,
         "competitive_landscape": market_analysis.competitive_landscape
     })
-    return {"final_report": result}
+    return {"final_report": result, **update}
 
 # 5. Build and Compile the Graph
-workflow = StateGraph(AgentState)
-workflow.add_node("data_collector", data_collection_node)
-workflow.add_node("financial_analyst", financial_analyst_node)
-workflow.add_node("market_analyst", market_analyst_node)
-workflow.add_node("final_advisor", final_advisor_node)
-workflow.set_entry_point("data_collector")
-workflow.add_edge("data_collector", "financial_analyst")
-workflow.add_edge("data_collector", "market_analyst")
-workflow.add_conditional_edges("financial_analyst", lambda state: "final_advisor" if state.get("market_analysis_result") else None)
-workflow.add_conditional_edges("market_analyst", lambda state: "final_advisor" if state.get("financial_analysis_result") else None)
-
-workflow.add_edge("final_advisor", END)
-app_graph = workflow.compile()
-
-# Main function to run the analysis
-def run_analysis(company_ticker: str):
-    inputs = {"company_ticker": company_ticker}
-    final_state = app_graph.invoke(inputs)
-    return final_state['final_report'].dict()
\ No newline at end of file
+# Compiled once per process, on the first analysis (or by warm_up)
+app_graph = None
+_graph_lock = threading.Lock()
+
+def build_graph():
+    workflow = StateGraph(AgentState)
+    workflow.add_node("data_collector", instrument_node("data_collector", data_collection_node))
+    workflow.add_node("financial_analyst", instrument_node("financial_analyst", financial_analyst_node))
+    workflow.add_node("market_analyst", instrument_node("market_analyst", market_analyst_node))
+    workflow.add_node("final_advisor", instrument_node("final_advisor", final_advisor_node))
+    workflow.set_entry_point("data_collector")
+    workflow.add_edge("data_collector", "financial_analyst")
+    workflow.add_edge("data_collector", "market_analyst")
+    # The analysts run in the same step; the advisor waits for both
+    workflow.add_edge(["financial_analyst", "market_analyst"], "final_advisor")
+
+    workflow.add_edge("final_advisor", END)
+    return workflow.compile()
+
+def get_graph():
+    global app_graph
+    with _graph_lock:
+        if app_graph is None:
+            app_graph = build_graph()
+        return app_graph
+
+def warm_up():
+    """
+    Pays the one-off costs of the first analysis up front: compiles the graph and builds
+    the search tool, the chat models behind each chain and the LLM response cache.
+    """
+    get_graph()
+    get_search_tool()
+    financial_chain = financial_summary_chain if settings.FINANCIAL_KEY_METRICS_FROM_DATA else financial_analyst_chain
+    for chain in (financial_chain, market_analyst_chain, final_advisor_chain):
+        chain.warm_up()
+
+def to_jsonable(value):
+    """Converts node updates (pydantic models, messages, nested containers) into JSON-friendly data."""
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, dict):
+        return {str(key): to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+def content_hash(value) -> str:
+    return hashlib.sha256(json.dumps(to_jsonable(value), sort_keys=True, default=str).encode()).hexdigest()
+
+ProgressCallback = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+# Main functions to run the analysis
+async def arun_analysis_with_intermediates(company_ticker: str, on_progress: Optional[ProgressCallback] = None,
+                                           previous: Optional[Dict[str, Any]] = None):
+    """
+    Streams the graph node by node. `on_progress(node, update)` is awaited with the
+    JSON-friendly output of each node as soon as that node finishes.
+
+    `previous` is the intermediates dict of an earlier run for the same ticker; analysis
+    steps whose inputs hash the same are taken from it instead of calling the LLM.
+    Returns the final report and this run's intermediates.
+    """
+    inputs = {"company_ticker": company_ticker, "previous_intermediates": previous or {}}
+    final_report = None
+    intermediates, llm_usage = {}, {}
+    async for step in get_graph().astream(inputs, stream_mode="updates"):
+        for node, update in step.items():
+            intermediates.update(update.get("intermediates") or {})
+            llm_usage.update(update.get("llm_usage") or {})
+            if on_progress:
+                await on_progress(node, to_jsonable({key: value for key, value in update.items() if key != "intermediates"}))
+            if node == "final_advisor":
+                final_report = update["final_report"]
+    print(f"LLM usage for {company_ticker}: ${sum(usage.get('cost_usd', 0.0) for usage in llm_usage.values()):.4f} "
+          + ", ".join(f"{node} {usage.get('model', 'reused')} {usage.get('seconds', 0.0):.1f}s" for node, usage in llm_usage.items()))
+    return final_report.dict(), to_jsonable(intermediates)
+
+async def arun_analysis(company_ticker: str, on_progress: Optional[ProgressCallback] = None,
+                        previous: Optional[Dict[str, Any]] = None):
+    report, _ = await arun_analysis_with_intermediates(company_ticker, on_progress, previous)
+    return report
+
+# Sync callers (worker threads) share one long-lived event loop, so async clients that
+# bind to the loop they were created on keep working across analyses
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_loop_lock = threading.Lock()
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name="ai-workflow-loop", daemon=True).start()
+        return _background_loop
+
+def run_in_background_loop(coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, get_background_loop()).result()
+
+def run_analysis(company_ticker: str, on_progress: Optional[ProgressCallback] = None,
+                 previous: Optional[Dict[str, Any]] = None):
+    """Sync wrapper for worker threads; returns (report, intermediates)."""
+    return run_in_background_loop(arun_analysis_with_intermediates(company_ticker, on_progress, previous))
+
+async def arun_batch_analysis(tickers: List[str],
+                              on_result: Callable[[str, Optional[dict], Optional[Exception], Optional[dict]], Awaitable[None]],
+                              on_progress: Optional[Callable[[str, str, Dict[str, Any]], Awaitable[None]]] = None,
+                              previous: Optional[Dict[str, Dict[str, Any]]] = None):
+    """
+    Analyses several tickers. Market data for all of them is loaded in one bulk step, then
+    the per-ticker graphs fan out with at most BATCH_LLM_CONCURRENCY running at once.
+    `on_result(ticker, report, error, intermediates)` is awaited as each ticker finishes,
+    and `on_progress(ticker, node, update)` after every node. `previous` maps tickers to
+    the intermediates of their last run.
+    """
+    market_data = get_market_data_provider()
+    if hasattr(market_data, "prefetch"):
+        await run_blocking(market_data.prefetch, tickers)
+
+    semaphore = asyncio.Semaphore(settings.BATCH_LLM_CONCURRENCY)
+
+    async def run_one(ticker: str):
+        async with semaphore:
+            try:
+                ticker_progress = (lambda node, update: on_progress(ticker, node, update)) if on_progress else None
+                report, intermediates = await arun_analysis_with_intermediates(
+                    ticker, ticker_progress, (previous or {}).get(ticker)
+                )
+            except Exception as e:
+                await on_result(ticker, None, e, None)
+                return
+        await on_result(ticker, report, None, intermediates)
+
+    await asyncio.gather(*(run_one(ticker) for ticker in tickers))
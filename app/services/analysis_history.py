@@ -0,0 +1,95 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import models
+
+STATUSES = ('pending', 'running', 'completed', 'failed')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, analysis_id: int) -> str:
+    payload = json.dumps([created_at.isoformat(), analysis_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, analysis_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(analysis_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e))
+
+
+async def list_analyses(
+    db: AsyncSession,
+    *,
+    user_id: Optional[int] = None,
+    company_id: Optional[int] = None,
+    status: Optional[str] = None,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    include_results: bool = False,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page of analyses, newest first, and the cursor for the next page (None on the last one).
+
+    Pages continue from the (created_at, id) of the previous page's last row rather than
+    using OFFSET, so every page is a range scan on one of the composite indexes on
+    AnalysisLog no matter how deep the client pages.
+    """
+    log = models.AnalysisLog
+    columns = [log.id, log.company_id, log.user_id, log.batch_id, log.status, log.error,
+               log.created_at, log.updated_at, models.Company.ticker_symbol]
+    if include_results:
+        columns.append(log.result_json)
+
+    query = select(*columns).join(models.Company, log.company_id == models.Company.id)
+    if user_id is not None:
+        query = query.where(log.user_id == user_id)
+    if company_id is not None:
+        query = query.where(log.company_id == company_id)
+    if status is not None:
+        query = query.where(log.status == status)
+    # SQLite keeps server-side created_at as whole-second text, which never compares equal to a
+    # bound datetime, so rows sharing the cursor's second would repeat forever. Its single writer
+    # hands out ids in insert order, so there the id alone orders and pages the rows.
+    by_id = db.get_bind().dialect.name == 'sqlite'
+    if cursor:
+        created_at, analysis_id = decode_cursor(cursor)
+        if by_id:
+            query = query.where(log.id < analysis_id)
+        else:
+            query = query.where(tuple_(log.created_at, log.id) < tuple_(created_at, analysis_id))
+    # Fetch one extra row to learn whether another page exists
+    order = [log.id.desc()] if by_id else [log.created_at.desc(), log.id.desc()]
+    query = query.order_by(*order).limit(limit + 1)
+
+    rows = (await db.execute(query)).all()
+    next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+
+    items = []
+    for row in rows[:limit]:
+        item = {
+            "id": row.id,
+            "company_id": row.company_id,
+            "ticker": row.ticker_symbol,
+            "user_id": row.user_id,
+            "batch_id": row.batch_id,
+            "status": row.status,
+            "error": row.error,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at,
+        }
+        if include_results:
+            item["result"] = row.result_json
+        items.append(item)
+    return items, next_cursor
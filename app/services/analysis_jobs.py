@@ -0,0 +1,306 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytz
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db import models
+from app.db.session import dialect_insert
+
+
+def _now():
+    return datetime.now(pytz.utc)
+
+
+# API side: lookups and enqueueing run on the event loop with an AsyncSession
+async def find_fresh_analysis(db: AsyncSession, company_id: int) -> Optional[models.AnalysisLog]:
+    """Latest completed analysis for the company that is still inside the freshness window."""
+    if settings.ANALYSIS_CACHE_TTL_SECONDS <= 0:
+        return None
+    cutoff = _now() - timedelta(seconds=settings.ANALYSIS_CACHE_TTL_SECONDS)
+    result = await db.execute(select(models.AnalysisLog).where(
+        models.AnalysisLog.company_id == company_id,
+        models.AnalysisLog.status == 'completed',
+        models.AnalysisLog.updated_at >= cutoff,
+    ).order_by(models.AnalysisLog.updated_at.desc()).limit(1))
+    return result.scalars().first()
+
+
+async def get_or_create_companies(db: AsyncSession, tickers: List[str]) -> Dict[str, models.Company]:
+    """Companies by ticker, creating the missing ones; safe when concurrent requests add the same ticker."""
+    query = select(models.Company).where(models.Company.ticker_symbol.in_(tickers))
+    companies = {company.ticker_symbol: company for company in (await db.execute(query)).scalars().all()}
+    missing = [ticker for ticker in tickers if ticker not in companies]
+    if missing:
+        # Tickers another request inserted first are skipped, then read back with the rest
+        insert = dialect_insert(db.get_bind().dialect.name)
+        await db.execute(insert(models.Company).values([
+            {"name": ticker, "ticker_symbol": ticker} for ticker in missing
+        ]).on_conflict_do_nothing(index_elements=[models.Company.ticker_symbol]))
+        await db.commit()
+        companies = {company.ticker_symbol: company for company in (await db.execute(query)).scalars().all()}
+    return companies
+
+
+async def find_inflight_analysis(db: AsyncSession, company_id: int) -> Optional[models.AnalysisLog]:
+    """Queued or running analysis for the company, so a new request can attach to it."""
+    result = await db.execute(select(models.AnalysisLog).where(
+        models.AnalysisLog.company_id == company_id,
+        models.AnalysisLog.status.in_(['pending', 'running']),
+    ).order_by(models.AnalysisLog.id.desc()).limit(1))
+    return result.scalars().first()
+
+
+def enqueue_statement(dialect_name: str, company_id: int, session_id: Optional[str] = None):
+    """Inserts a pending analysis unless the company already has one in flight."""
+    insert = dialect_insert(dialect_name)
+    return insert(models.AnalysisLog).values(
+        company_id=company_id, session_id=session_id, status='pending', attempts=0
+    ).on_conflict_do_nothing(index_elements=[models.AnalysisLog.company_id], index_where=models.INFLIGHT_ANALYSIS)
+
+
+async def enqueue_analysis(db: AsyncSession, company_id: int) -> models.AnalysisLog:
+    """Queues an analysis for the company, or returns the one a concurrent request queued first."""
+    while True:
+        await db.execute(enqueue_statement(db.get_bind().dialect.name, company_id))
+        await db.commit()
+        result = await db.execute(select(models.AnalysisLog).where(
+            models.AnalysisLog.company_id == company_id,
+            models.INFLIGHT_ANALYSIS,
+        ))
+        log = result.scalars().first()
+        # None only if the job finished between the insert and the read; queue another
+        if log:
+            return log
+
+
+async def enqueue_batch(db: AsyncSession, companies: List[models.Company]) -> Tuple[models.AnalysisBatch, List[models.AnalysisLog]]:
+    """
+    Creates a batch with one child AnalysisLog per company. Companies with a fresh result
+    get a completed child carrying that result, so only stale tickers are re-analysed.
+    """
+    batch = models.AnalysisBatch(status='pending', attempts=0)
+    db.add(batch)
+    await db.flush()
+    children = []
+    for company in companies:
+        fresh_log = await find_fresh_analysis(db, company.id)
+        if fresh_log:
+            children.append(models.AnalysisLog(company_id=company.id, batch_id=batch.id, status='completed',
+                                               result_json=fresh_log.result_json,
+                                               intermediate_json=fresh_log.intermediate_json, attempts=0))
+        else:
+            children.append(models.AnalysisLog(company_id=company.id, batch_id=batch.id, status='pending', attempts=0))
+    db.add_all(children)
+    if all(child.status == 'completed' for child in children):
+        batch.status = 'completed'
+    await db.commit()
+    return batch, children
+
+
+# Worker side: claiming and finishing jobs runs in threads with a sync Session
+# Both AnalysisLog and AnalysisBatch rows are jobs: they share status, attempts,
+# worker_id and claimed_at columns and go through the same claim/retry cycle.
+def _claimable_filter(model):
+    stale_before = _now() - timedelta(seconds=settings.ANALYSIS_CLAIM_TIMEOUT_SECONDS)
+    return and_(
+        model.attempts < settings.ANALYSIS_MAX_ATTEMPTS,
+        or_(
+            model.status == 'pending',
+            and_(model.status == 'running', model.claimed_at < stale_before),
+        ),
+    )
+
+
+def _claim_next(db: Session, model, worker_id: str, *criteria):
+    # A new attempt starts with no progress, so clients don't see the previous attempt's nodes
+    reset = {"progress_json": None} if hasattr(model, "progress_json") else {}
+    query = db.query(model).filter(_claimable_filter(model), *criteria).order_by(model.created_at, model.id)
+
+    if db.get_bind().dialect.name == 'postgresql':
+        job = query.with_for_update(skip_locked=True).first()
+        if not job:
+            db.rollback()
+            return None
+        job.status = 'running'
+        job.worker_id = worker_id
+        job.claimed_at = _now()
+        job.attempts = job.attempts + 1
+        for column, value in reset.items():
+            setattr(job, column, value)
+        db.commit()
+        return job
+
+    # SQLite and friends have no SKIP LOCKED: compare-and-set on the attempts counter,
+    # which changes on every claim, and move on to the next candidate if we lost the race.
+    for candidate_id, attempts in query.with_entities(model.id, model.attempts).limit(10).all():
+        claimed = db.query(model).filter(
+            model.id == candidate_id,
+            model.attempts == attempts,
+            _claimable_filter(model),
+        ).update({
+            "status": 'running',
+            "worker_id": worker_id,
+            "claimed_at": _now(),
+            "attempts": attempts + 1,
+            **reset,
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return db.get(model, candidate_id)
+    return None
+
+
+def claim_next_analysis(db: Session, worker_id: str) -> Optional[models.AnalysisLog]:
+    """
+    Atomically claims the oldest runnable stand-alone job: a pending one, or a running one
+    whose worker stopped heartbeating. Batch children run as part of their batch.
+    """
+    return _claim_next(db, models.AnalysisLog, worker_id, models.AnalysisLog.batch_id.is_(None))
+
+
+def claim_next_batch(db: Session, worker_id: str) -> Optional[models.AnalysisBatch]:
+    return _claim_next(db, models.AnalysisBatch, worker_id)
+
+
+def heartbeat_jobs(db: Session, model, job_ids: List[int], worker_id: str):
+    """Refreshes the claim on jobs this worker is still running so they are not retried elsewhere."""
+    if not job_ids:
+        return
+    db.query(model).filter(
+        model.id.in_(job_ids),
+        model.status == 'running',
+        model.worker_id == worker_id,
+    ).update({"claimed_at": _now()}, synchronize_session=False)
+    db.commit()
+
+
+def _held_by(model, job_id: int, worker_id: str):
+    # A job reclaimed after a missed heartbeat belongs to its new worker; the old one must not touch it
+    return and_(model.id == job_id, model.status == 'running', model.worker_id == worker_id)
+
+
+def record_progress(db: Session, analysis_id: int, worker_id: str, node: str, update: Dict[str, Any]):
+    log = db.query(models.AnalysisLog).filter(_held_by(models.AnalysisLog, analysis_id, worker_id)).first()
+    if log:
+        # Reassign rather than mutate so the JSON column is flagged as changed
+        log.progress_json = {**(log.progress_json or {}), node: update}
+        db.commit()
+
+
+def complete_analysis(db: Session, analysis_id: int, worker_id: str, result: Dict[str, Any],
+                      intermediates: Optional[Dict[str, Any]] = None) -> bool:
+    """Stores the result; returns False, writing nothing, if `worker_id` no longer holds the job."""
+    values = {"status": 'completed', "result_json": result, "error": None}
+    if intermediates is not None:
+        values["intermediate_json"] = intermediates
+    updated = db.query(models.AnalysisLog).filter(_held_by(models.AnalysisLog, analysis_id, worker_id)).update(
+        values, synchronize_session=False
+    )
+    db.commit()
+    return updated > 0
+
+
+def previous_intermediates(db: Session, company_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Intermediates of the latest completed analysis per company, for incremental re-runs."""
+    if not settings.ANALYSIS_REUSE_INTERMEDIATES or not company_ids:
+        return {}
+    latest = db.query(
+        models.AnalysisLog.company_id, func.max(models.AnalysisLog.id).label("id")
+    ).filter(
+        models.AnalysisLog.company_id.in_(company_ids),
+        models.AnalysisLog.status == 'completed',
+        models.AnalysisLog.intermediate_json.isnot(None),
+    ).group_by(models.AnalysisLog.company_id).subquery()
+    rows = db.query(models.AnalysisLog.company_id, models.AnalysisLog.intermediate_json).join(
+        latest, models.AnalysisLog.id == latest.c.id
+    ).all()
+    return {company_id: intermediates for company_id, intermediates in rows}
+
+
+def fail_job(db: Session, model, job_id: int, worker_id: str, error: str, retry: bool = True) -> Optional[str]:
+    """
+    Puts the job back on the queue, or marks it failed once it has used all its attempts.
+    Returns the new status, or None, writing nothing, if `worker_id` no longer holds the job.
+    """
+    status = case((model.attempts < settings.ANALYSIS_MAX_ATTEMPTS, 'pending'), else_='failed') if retry else 'failed'
+    updated = db.query(model).filter(_held_by(model, job_id, worker_id)).update({
+        "status": status,
+        "worker_id": None,
+        "claimed_at": None,
+        "error": error,
+    }, synchronize_session=False)
+    db.commit()
+    if not updated:
+        return None
+    return db.query(model.status).filter(model.id == job_id).scalar()
+
+
+def finish_batch(db: Session, batch_id: int, worker_id: str) -> Optional[str]:
+    """
+    Sets a batch's status from its children after a run: back to pending while children
+    wait for a retry and the batch has attempts left, otherwise completed, partial or failed.
+    Returns None, writing nothing, if `worker_id` no longer holds the batch.
+    """
+    batch = db.query(models.AnalysisBatch).filter(
+        _held_by(models.AnalysisBatch, batch_id, worker_id)
+    ).with_for_update().first()
+    if batch is None:
+        db.rollback()
+        return None
+    statuses = [status for (status,) in db.query(models.AnalysisLog.status).filter(
+        models.AnalysisLog.batch_id == batch_id
+    ).all()]
+    unfinished = sum(1 for status in statuses if status in ('pending', 'running'))
+    batch.worker_id = None
+    batch.claimed_at = None
+    if unfinished and batch.attempts < settings.ANALYSIS_MAX_ATTEMPTS:
+        batch.status = 'pending'
+        batch.error = f"{unfinished} of {len(statuses)} analyses waiting for a retry"
+        db.commit()
+        return batch.status
+    if unfinished:
+        fail_unfinished_children(db, [batch_id], "Batch ran out of attempts")
+    completed = statuses.count('completed')
+    if completed == len(statuses):
+        batch.status, batch.error = 'completed', None
+    else:
+        batch.status = 'partial' if completed else 'failed'
+        batch.error = f"{len(statuses) - completed} of {len(statuses)} analyses failed"
+    db.commit()
+    return batch.status
+
+
+def fail_unfinished_children(db: Session, batch_ids: List[int], error: str):
+    if not batch_ids:
+        return
+    db.query(models.AnalysisLog).filter(
+        models.AnalysisLog.batch_id.in_(batch_ids),
+        models.AnalysisLog.status.in_(['pending', 'running']),
+    ).update({"status": 'failed', "error": error}, synchronize_session=False)
+
+
+def reap_stale_jobs(db: Session) -> int:
+    """Fails running jobs (and their batch children) whose worker died on the last allowed attempt."""
+    stale_before = _now() - timedelta(seconds=settings.ANALYSIS_CLAIM_TIMEOUT_SECONDS)
+    error = "Worker stopped responding"
+    reaped = 0
+    for model in (models.AnalysisLog, models.AnalysisBatch):
+        stale_ids = [row.id for row in db.query(model.id).filter(
+            model.status == 'running',
+            model.claimed_at < stale_before,
+            model.attempts >= settings.ANALYSIS_MAX_ATTEMPTS,
+        ).all()]
+        if not stale_ids:
+            continue
+        db.query(model).filter(model.id.in_(stale_ids)).update(
+            {"status": 'failed', "error": error}, synchronize_session=False
+        )
+        if model is models.AnalysisBatch:
+            fail_unfinished_children(db, stale_ids, error)
+        reaped += len(stale_ids)
+    db.commit()
+    return reaped
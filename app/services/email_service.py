@@ -15,6 +15,6 @@ async def send_otp_email(email: str, otp: str):
     print("--- EMAIL SERVICE (MOCK) ---")
     print(f"Sending OTP to: {email}")
     print(f"OTP Code: {otp}")
-    print(f"Using API Key: {settings.EMAIL_API_KEY[:5]}...")
+    print(f"Using API Key: {settings.email_api_key[:5]}...")
     print("--- END EMAIL SERVICE ---")
     return True
\ No newline at end of file
@@ -0,0 +1,273 @@
+"""
+Columnar fundamentals for every known ticker: the companies table and the FMP listing,
+with market data filled in as it reaches the shared cache. Analyses, scheduler prefetches
+and the scheduler's backfill write that cache; this module only reads it.
+Statement rows are kept as (tickers x years) arrays and quote fields as one array each,
+so derived metrics are computed for the whole universe in a handful of vectorized
+operations. Tickers without market data yet have NaN metrics and match no bounds.
+
+numpy and pandas are imported inside the functions that need them to keep them out of
+the import path of code that never touches fundamentals.
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.market_data import Statement, get_market_data_provider
+
+YEARS = 4
+# Income statement rows from yfinance `financials`, newest period first
+STATEMENT_ROWS = {
+    "revenue": "Total Revenue",
+    "gross_profit": "Gross Profit",
+    "operating_income": "Operating Income",
+    "net_income": "Net Income",
+}
+NUMERIC_INFO_FIELDS = {
+    "market_cap": "marketCap",
+    "pe_ratio": "trailingPE",
+    "forward_pe": "forwardPE",
+    "debt_to_equity": "debtToEquity",
+}
+TEXT_INFO_FIELDS = {"name": "shortName", "sector": "sector", "industry": "industry"}
+
+METRICS = [
+    "market_cap", "pe_ratio", "forward_pe", "price_to_sales", "revenue", "net_income",
+    "revenue_growth_yoy", "revenue_cagr", "net_income_growth_yoy",
+    "gross_margin", "operating_margin", "net_margin", "debt_to_equity",
+]
+
+
+def _number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def statement_series(statement: Statement, row: str) -> List[float]:
+    """Values of one statement row for the latest YEARS periods, newest first, NaN padded."""
+    periods = statement.get(row) or {}
+    values = [_number(periods[period]) for period in sorted(periods, reverse=True)[:YEARS]]
+    return values + [float("nan")] * (YEARS - len(values))
+
+
+def compute_metrics(columns: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Derived metrics for every row at once. `columns` holds a (n, YEARS) array per statement
+    row and a (n,) array per numeric quote field; the result holds a (n,) array per metric.
+    """
+    import numpy as np
+
+    revenue, net_income = columns["revenue"], columns["net_income"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # CAGR over however many consecutive years each ticker has, oldest at index valid - 1
+        valid = np.cumprod(~np.isnan(revenue), axis=1).sum(axis=1)
+        oldest = revenue[np.arange(len(revenue)), np.clip(valid - 1, 0, YEARS - 1)]
+        growable = (valid >= 2) & (revenue[:, 0] > 0) & (oldest > 0)
+        cagr = np.full(len(revenue), np.nan)
+        cagr[growable] = (revenue[growable, 0] / oldest[growable]) ** (1 / (valid[growable] - 1)) - 1
+
+        metrics = {
+            "market_cap": columns["market_cap"],
+            "pe_ratio": columns["pe_ratio"],
+            "forward_pe": columns["forward_pe"],
+            "price_to_sales": columns["market_cap"] / revenue[:, 0],
+            "revenue": revenue[:, 0],
+            "net_income": net_income[:, 0],
+            "revenue_growth_yoy": revenue[:, 0] / revenue[:, 1] - 1,
+            "revenue_cagr": cagr,
+            "net_income_growth_yoy": (net_income[:, 0] - net_income[:, 1]) / np.abs(net_income[:, 1]),
+            "gross_margin": columns["gross_profit"][:, 0] / revenue[:, 0],
+            "operating_margin": columns["operating_income"][:, 0] / revenue[:, 0],
+            "net_margin": net_income[:, 0] / revenue[:, 0],
+            # yfinance reports debt/equity in percent
+            "debt_to_equity": columns["debt_to_equity"] / 100,
+        }
+    return {name: np.where(np.isfinite(values), values, np.nan) for name, values in metrics.items()}
+
+
+def _to_columns(rows: List[Tuple[Dict[str, Any], Statement]]) -> Dict[str, Any]:
+    import numpy as np
+
+    columns = {
+        name: np.array([statement_series(financials, row) for _, financials in rows], dtype=float).reshape(len(rows), YEARS)
+        for name, row in STATEMENT_ROWS.items()
+    }
+    for name, key in NUMERIC_INFO_FIELDS.items():
+        columns[name] = np.array([_number(info.get(key)) for info, _ in rows], dtype=float)
+    return columns
+
+
+class FundamentalsStore:
+    """
+    Listed tickers and the latest quote info and statements per ticker, with the metrics
+    table rebuilt lazily after changes.
+    """
+
+    def __init__(self):
+        self._names: Dict[str, str] = {}
+        self._info: Dict[str, Dict[str, Any]] = {}
+        self._financials: Dict[str, Statement] = {}
+        self._lock = threading.Lock()
+        self._frame = None
+        self._dirty = False
+
+    def _tickers(self) -> List[str]:
+        return sorted(set(self._names) | set(self._info) | set(self._financials))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tickers())
+
+    def register(self, entries: Iterable[Tuple[str, str]]) -> int:
+        """Adds (ticker, name) pairs to the universe; returns how many were new."""
+        added = 0
+        with self._lock:
+            for ticker, name in entries:
+                ticker = ticker.upper()
+                if ticker not in self._names:
+                    self._names[ticker] = name
+                    added += 1
+            self._dirty = self._dirty or added > 0
+        return added
+
+    def upsert(self, ticker: str, info: Optional[Dict[str, Any]] = None, financials: Optional[Statement] = None):
+        ticker = ticker.upper()
+        with self._lock:
+            if info is not None:
+                self._info[ticker] = info
+            if financials is not None:
+                self._financials[ticker] = financials
+            self._dirty = True
+
+    def metrics_for(self, ticker: str) -> Dict[str, Optional[float]]:
+        """Derived metrics for one ticker, computed with the same code path as the full table."""
+        ticker = ticker.upper()
+        with self._lock:
+            row = (self._info.get(ticker, {}), self._financials.get(ticker, {}))
+        values = compute_metrics(_to_columns([row]))
+        return {name: (None if values[name][0] != values[name][0] else round(float(values[name][0]), 4))
+                for name in METRICS}
+
+    def frame(self):
+        """pandas DataFrame indexed by ticker with one column per metric plus name/sector/industry."""
+        import pandas as pd
+
+        with self._lock:
+            if self._frame is not None and not self._dirty:
+                return self._frame
+            tickers = self._tickers()
+            rows = [(self._info.get(ticker, {}), self._financials.get(ticker, {})) for ticker in tickers]
+            names = [self._names.get(ticker) for ticker in tickers]
+            self._dirty = False
+        frame = pd.DataFrame(compute_metrics(_to_columns(rows)), index=pd.Index(tickers, name="ticker"))
+        for name, key in TEXT_INFO_FIELDS.items():
+            frame[name] = pd.array([info.get(key) for info, _ in rows], dtype="string")
+        frame["name"] = frame["name"].fillna(pd.Series(names, index=frame.index, dtype="string"))
+        with self._lock:
+            self._frame = frame
+        return frame
+
+    def screen(self, minimums: Dict[str, float], maximums: Dict[str, float], sector: Optional[str] = None,
+               sort_by: str = "market_cap", descending: bool = True, limit: int = 50) -> Tuple[int, List[Dict[str, Any]]]:
+        """Filters the universe with boolean masks and returns (match count, top `limit` rows)."""
+        import numpy as np
+        import pandas as pd
+
+        frame = self.frame()
+        if frame.empty:
+            return 0, []
+        mask = np.ones(len(frame), dtype=bool)
+        for metric, bound in minimums.items():
+            mask &= (frame[metric] >= bound).to_numpy()
+        for metric, bound in maximums.items():
+            mask &= (frame[metric] <= bound).to_numpy()
+        if sector:
+            mask &= (frame["sector"].astype("string").str.lower() == sector.lower()).fillna(False).to_numpy(dtype=bool)
+        matches = frame[mask]
+        ranked = matches.sort_values(sort_by, ascending=not descending, na_position="last").head(limit)
+        results = []
+        for ticker, row in zip(ranked.index, ranked.astype(object).to_dict("records")):
+            results.append({"ticker": ticker, **{
+                key: (None if pd.isna(value) else value) for key, value in row.items()
+            }})
+        return len(matches), results
+
+
+class FundamentalsService:
+    """
+    Keeps the store's universe in step with the ticker index (companies table and FMP
+    listing) and its data in step with the shared market-data disk cache. It never fetches
+    market data itself, so API processes do not spend the yfinance rate limit.
+    """
+
+    def __init__(self):
+        self.store = FundamentalsStore()
+        self._loaded_until = {"info": 0.0, "financials": 0.0}
+        self._seeded_from = None
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, ticker: str, info: Dict[str, Any], financials: Statement):
+        self.store.upsert(ticker, info, financials)
+
+    def metrics_for(self, ticker: str) -> Dict[str, Optional[float]]:
+        return self.store.metrics_for(ticker)
+
+    def load_from_disk(self) -> int:
+        """Upserts entries written to the disk cache since the last load; returns how many."""
+        disk_store = getattr(get_market_data_provider(), "disk_store", None)
+        if disk_store is None:
+            return 0
+        loaded = 0
+        for field in ("info", "financials"):
+            for ticker, value, fetched_at in disk_store.changed_since(field, self._loaded_until[field]):
+                self.store.upsert(ticker, **{field: value})
+                self._loaded_until[field] = max(self._loaded_until[field], fetched_at)
+                loaded += 1
+        return loaded
+
+    def seed_universe(self) -> int:
+        """Registers every ticker in the current ticker index; returns how many were new."""
+        from app.services.ticker_index import ticker_index
+
+        index = ticker_index.index
+        if index is self._seeded_from:
+            return 0
+        self._seeded_from = index
+        return self.store.register((entry["ticker_symbol"], entry["name"]) for entry in index.entries)
+
+    async def refresh(self):
+        started = time.perf_counter()
+        seeded = self.seed_universe()
+        loaded = await asyncio.to_thread(self.load_from_disk)
+        if seeded or loaded:
+            await asyncio.to_thread(self.store.frame)
+            print(f"Fundamentals store: {seeded} listed, {loaded} cache update(s), "
+                  f"{len(self.store)} tickers, refreshed in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Fundamentals refresh failed: {e}")
+            await asyncio.sleep(settings.FUNDAMENTALS_REFRESH_SECONDS)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+fundamentals = FundamentalsService()
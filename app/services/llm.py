@@ -0,0 +1,337 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import closing
+from typing import Any, Callable, Dict, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.exceptions import OutputParserException
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.pydantic_v1 import ValidationError
+from langchain_core.runnables import RunnableLambda
+
+from app.core.config import settings
+from app.core.metrics import LLM_CACHE_LOOKUPS, LLM_CALL_DURATION, LLM_COST, LLM_ESCALATIONS, LLM_TOKENS
+from app.core.outbound import call
+
+
+# 1. Response caches, keyed by a hash of model, output schema and rendered prompt
+class ResponseCache(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Dict[str, Any]):
+        ...
+
+
+class NullResponseCache(ResponseCache):
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        pass
+
+
+class InMemoryResponseCache(ResponseCache):
+    """LRU bounded to `max_entries` responses."""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteResponseCache(ResponseCache):
+    """Persistent cache shared by every process on the host; evicts least recently used rows."""
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_responses_last_used ON llm_responses (last_used)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT payload FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                conn.execute("UPDATE llm_responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, payload, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(value, default=str), time.time()),
+            )
+            conn.execute(
+                "DELETE FROM llm_responses WHERE key IN ("
+                "SELECT key FROM llm_responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+def build_response_cache() -> ResponseCache:
+    if settings.LLM_CACHE_BACKEND == "sqlite":
+        return SQLiteResponseCache(settings.LLM_CACHE_PATH, settings.LLM_CACHE_MAX_ENTRIES)
+    if settings.LLM_CACHE_BACKEND == "memory":
+        return InMemoryResponseCache(settings.LLM_CACHE_MAX_ENTRIES)
+    return NullResponseCache()
+
+
+# 2. Chat models
+def google_chat_model(model_name: str):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    # Retries, backoff and rate limiting happen in app.core.outbound, not in the client
+    return ChatGoogleGenerativeAI(model=model_name, google_api_key=settings.GOOGLE_API_KEY, max_retries=1)
+
+
+def _placeholder(annotation, name: str):
+    origin = typing.get_origin(annotation)
+    if origin in (list, typing.List):
+        return [f"{name} (fake)"]
+    if origin in (dict, typing.Dict) or annotation is dict:
+        return {}
+    return f"{name} (fake)"
+
+
+class FakeStructuredChatModel:
+    """
+    Offline stand-in for ChatGoogleGenerativeAI. `with_structured_output(schema)` returns a
+    runnable that waits `latency` seconds and fills every field of the schema with placeholders
+    (or with `responses[schema.__name__]` when given).
+    """
+
+    def __init__(self, model_name: str = "fake", latency: float = 0.0, responses: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.model = model_name
+        self.latency = latency
+        self.responses = responses or {}
+        self.calls = 0
+
+    def _build(self, schema, prompt_value):
+        self.calls += 1
+        if schema.__name__ in self.responses:
+            return schema.parse_obj(self.responses[schema.__name__])
+        values = {name: _placeholder(field.outer_type_, name) for name, field in schema.__fields__.items()}
+        return schema.parse_obj(values)
+
+    def with_structured_output(self, schema):
+        def respond(prompt_value):
+            time.sleep(self.latency)
+            return self._build(schema, prompt_value)
+
+        async def arespond(prompt_value):
+            await asyncio.sleep(self.latency)
+            return self._build(schema, prompt_value)
+
+        return RunnableLambda(respond, afunc=arespond)
+
+
+# 3. Chains built once per process and shared by every analysis
+_chat_model_factory: Callable[[str], Any] = google_chat_model
+_response_cache: Optional[ResponseCache] = None
+_generation = 0
+_lock = threading.Lock()
+
+
+def configure_llm(chat_model_factory: Optional[Callable[[str], Any]] = None, response_cache: Optional[ResponseCache] = None):
+    """Swaps the chat model factory and/or response cache; chains rebuild on their next call."""
+    global _chat_model_factory, _response_cache, _generation
+    with _lock:
+        if chat_model_factory is not None:
+            _chat_model_factory = chat_model_factory
+        if response_cache is not None:
+            _response_cache = response_cache
+        _generation += 1
+
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    with _lock:
+        if _response_cache is None:
+            _response_cache = build_response_cache()
+        return _response_cache
+
+
+def token_usage(response) -> typing.Tuple[int, int]:
+    """(prompt, completion) tokens from an LLMResult, whichever way the provider reports them."""
+    prompt = completion = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt += usage.get("input_tokens", 0)
+                completion += usage.get("output_tokens", 0)
+                continue
+            usage = (generation.generation_info or {}).get("usage_metadata") or {}
+            prompt += usage.get("prompt_token_count", 0)
+            completion += usage.get("candidates_token_count", 0)
+    if not (prompt or completion):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return prompt, completion
+
+
+def invalid_output(error: BaseException) -> bool:
+    """True if the call succeeded but the model's structured output did not parse or validate."""
+    error = getattr(error, "error", None) or error  # unwrap OutboundError
+    return isinstance(error, (OutputParserException, ValidationError))
+
+
+def call_cost(model_name: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = settings.LLM_MODEL_PRICES.get(model_name, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """
+    Adds the tokens and estimated cost of every model call in a chain run to
+    llm_tokens_total and llm_cost_usd_total, and to `usage` when given.
+    """
+
+    def __init__(self, node: str, model_name: str, usage: Optional[Dict[str, Any]] = None):
+        self.node = node
+        self.model_name = model_name
+        self.usage = usage
+
+    def on_llm_end(self, response, **kwargs):
+        prompt, completion = token_usage(response)
+        cost = call_cost(self.model_name, prompt, completion)
+        LLM_TOKENS.labels(self.node, self.model_name, "prompt").inc(prompt)
+        LLM_TOKENS.labels(self.node, self.model_name, "completion").inc(completion)
+        LLM_COST.labels(self.node, self.model_name).inc(cost)
+        if self.usage is not None:
+            self.usage["prompt_tokens"] += prompt
+            self.usage["completion_tokens"] += completion
+            self.usage["cost_usd"] += cost
+
+
+class StructuredChain:
+    """
+    `prompt | model.with_structured_output(schema)`, built lazily once per model and fronted
+    by the response cache. The model is LLM_NODE_MODELS[name] unless given; when its output
+    fails to parse the call is repeated once on the escalation model.
+    """
+
+    def __init__(self, name: str, schema, prompt: ChatPromptTemplate, model_name: Optional[str] = None,
+                 escalation_model_name: Optional[str] = None):
+        self.name = name
+        self.schema = schema
+        self.prompt = prompt
+        self.model_name = model_name or settings.LLM_NODE_MODELS.get(name) or settings.LLM_MODEL
+        escalation_model_name = escalation_model_name or settings.LLM_ESCALATION_MODEL or settings.LLM_MODEL
+        self.escalation_model_name = (
+            escalation_model_name
+            if settings.LLM_ESCALATE_ON_INVALID and escalation_model_name != self.model_name else None
+        )
+        self._runnables: Dict[str, Any] = {}
+        self._built_for = -1
+        self._schema_json = json.dumps(schema.schema(), sort_keys=True)
+        # Identifies what the chain computes, independent of its inputs
+        self.fingerprint = hashlib.sha256(
+            json.dumps([self.model_name, self._schema_json, prompt.pretty_repr()]).encode()
+        ).hexdigest()
+
+    def _get_runnable(self, model_name: str):
+        with _lock:
+            if self._built_for != _generation:
+                self._runnables = {}
+                self._built_for = _generation
+            if model_name not in self._runnables:
+                model = _chat_model_factory(model_name)
+                self._runnables[model_name] = self.prompt | model.with_structured_output(self.schema)
+            return self._runnables[model_name]
+
+    def warm_up(self):
+        self._get_runnable(self.model_name)
+        get_response_cache()
+
+    def cache_key(self, inputs: Dict[str, Any]) -> str:
+        messages = self.prompt.format_messages(**inputs)
+        payload = json.dumps({
+            "model": self.model_name,
+            "schema": self._schema_json,
+            "messages": [[message.type, message.content] for message in messages],
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def _invoke(self, model_name: str, inputs: Dict[str, Any], usage: Dict[str, Any]):
+        runnable = self._get_runnable(model_name)
+        handler = TokenUsageHandler(self.name, model_name, usage)
+        started = time.perf_counter()
+        try:
+            result = await call(
+                "gemini", self.name,
+                lambda: runnable.ainvoke(inputs, config={"callbacks": [handler]}),
+                hedge_after=settings.LLM_HEDGE_AFTER_SECONDS or None,
+            )
+        finally:
+            LLM_CALL_DURATION.labels(self.name, model_name).observe(time.perf_counter() - started)
+        # with_structured_output returns None when the model answers without calling the schema tool
+        if not isinstance(result, self.schema):
+            raise OutputParserException(f"{self.name}: {model_name} returned no valid {self.schema.__name__}")
+        return result
+
+    async def ainvoke(self, inputs: Dict[str, Any], usage: Optional[Dict[str, Any]] = None):
+        """
+        `usage`, when given, is filled with the model that answered, whether the answer came
+        from the cache or the escalation model, tokens, estimated cost and seconds taken.
+        """
+        usage = usage if usage is not None else {}
+        usage.update(model=self.model_name, cached=False, escalated=False,
+                     prompt_tokens=0, completion_tokens=0, cost_usd=0.0, seconds=0.0)
+        started = time.perf_counter()
+        cache = get_response_cache()
+        key = self.cache_key(inputs)
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            LLM_CACHE_LOOKUPS.labels(self.name, "hit").inc()
+            usage.update(cached=True, seconds=time.perf_counter() - started)
+            return self.schema.parse_obj(cached)
+        LLM_CACHE_LOOKUPS.labels(self.name, "miss").inc()
+        try:
+            result = await self._invoke(self.model_name, inputs, usage)
+        except Exception as e:
+            if self.escalation_model_name is None or not invalid_output(e):
+                raise
+            print(f"{self.name}: invalid output from {self.model_name}, escalating to {self.escalation_model_name}: {e}")
+            LLM_ESCALATIONS.labels(self.name, self.escalation_model_name).inc()
+            usage.update(model=self.escalation_model_name, escalated=True)
+            result = await self._invoke(self.escalation_model_name, inputs, usage)
+        usage["seconds"] = time.perf_counter() - started
+        # Stored under the routed model's key, so a repeat of an escalated prompt skips straight to the answer
+        await asyncio.to_thread(cache.set, key, result.dict())
+        return result
@@ -0,0 +1,360 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.outbound import call_sync
+
+# A statement is {row label: {period (ISO date): value}}, e.g. {"Total Revenue": {"2023-09-30": 3.8e11}}
+Statement = Dict[str, Dict[str, Optional[float]]]
+
+
+def _clean_number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def frame_to_statement(frame) -> Statement:
+    """Converts a yfinance statement DataFrame (rows = items, columns = periods) into plain dicts."""
+    if frame is None or frame.empty:
+        return {}
+    statement = {}
+    for row_label, row in frame.iterrows():
+        statement[str(row_label)] = {
+            (period.date().isoformat() if hasattr(period, "date") else str(period)): _clean_number(value)
+            for period, value in row.items()
+        }
+    return statement
+
+
+# 1. Providers
+class MarketDataProvider(ABC):
+    """Source of quote info and financial statements for a ticker."""
+
+    @abstractmethod
+    def get_info(self, ticker: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def get_financials(self, ticker: str) -> Statement:
+        ...
+
+    def get_many(self, field: str, tickers: List[str]) -> Dict[str, Any]:
+        """Fetches one field for several tickers. Tickers that fail are left out of the result."""
+        fetch = self.get_info if field == "info" else self.get_financials
+        results = {}
+        for ticker in tickers:
+            try:
+                results[ticker] = fetch(ticker)
+            except Exception as e:
+                print(f"Market data {field} fetch failed for {ticker}: {e}")
+        return results
+
+
+class YFinanceProvider(MarketDataProvider):
+    def get_info(self, ticker: str) -> Dict[str, Any]:
+        import yfinance as yf
+        return call_sync("yfinance", "info", lambda: dict(yf.Ticker(ticker).info or {}))
+
+    def get_financials(self, ticker: str) -> Statement:
+        import yfinance as yf
+        return call_sync("yfinance", "financials", lambda: frame_to_statement(yf.Ticker(ticker).financials))
+
+    def get_many(self, field: str, tickers: List[str]) -> Dict[str, Any]:
+        # yf.Tickers shares one HTTP session and cookie/crumb handshake across symbols;
+        # the per-symbol requests then run in parallel instead of one after another.
+        import yfinance as yf
+        if not tickers:
+            return {}
+        bundle = yf.Tickers(" ".join(tickers))
+
+        def fetch(ticker):
+            stock = bundle.tickers[ticker.upper()]
+            if field == "info":
+                return call_sync("yfinance", field, lambda: dict(stock.info or {}))
+            return call_sync("yfinance", field, lambda: frame_to_statement(stock.financials))
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(len(tickers), settings.YFINANCE_MAX_WORKERS)) as pool:
+            futures = {ticker: pool.submit(fetch, ticker) for ticker in tickers}
+            for ticker, future in futures.items():
+                try:
+                    results[ticker] = future.result()
+                except Exception as e:
+                    print(f"Market data {field} fetch failed for {ticker}: {e}")
+        return results
+
+
+class FakeMarketDataProvider(MarketDataProvider):
+    """
+    Offline provider returning deterministic synthetic data derived from the ticker.
+    Explicit `info`/`financials` dicts (keyed by ticker) override the synthetic values.
+    """
+
+    def __init__(self, info: Optional[Dict[str, Dict[str, Any]]] = None,
+                 financials: Optional[Dict[str, Statement]] = None, latency: float = 0.0):
+        self.info = info or {}
+        self.financials = financials or {}
+        self.latency = latency
+        self.calls = {"info": 0, "financials": 0}
+
+    def _seed(self, ticker: str) -> int:
+        return int(hashlib.sha256(ticker.upper().encode()).hexdigest()[:8], 16)
+
+    def get_info(self, ticker: str) -> Dict[str, Any]:
+        self.calls["info"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if ticker in self.info:
+            return dict(self.info[ticker])
+        seed = self._seed(ticker)
+        return {
+            "symbol": ticker.upper(),
+            "shortName": f"{ticker.upper()} Corp",
+            "marketCap": (seed % 2000 + 1) * 10**9,
+            "trailingPE": round(5 + seed % 60 + (seed % 100) / 100, 2),
+            "forwardPE": round(5 + seed % 45 + (seed % 100) / 100, 2),
+            "revenueGrowth": round(((seed % 61) - 20) / 100, 3),
+            "debtToEquity": round(seed % 250 + (seed % 10) / 10, 1),
+        }
+
+    def get_financials(self, ticker: str) -> Statement:
+        self.calls["financials"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if ticker in self.financials:
+            return json.loads(json.dumps(self.financials[ticker]))
+        seed = self._seed(ticker)
+        revenue = float((seed % 500 + 10) * 10**8)
+        growth = 1 + ((seed % 41) - 10) / 100
+        margin = ((seed % 30) + 5) / 100
+        statement = {"Total Revenue": {}, "Gross Profit": {}, "Operating Income": {}, "Net Income": {}}
+        for offset, year in enumerate(range(2023, 2019, -1)):
+            period = f"{year}-12-31"
+            period_revenue = round(revenue / growth ** offset, 2)
+            statement["Total Revenue"][period] = period_revenue
+            statement["Gross Profit"][period] = round(period_revenue * (margin + 0.3), 2)
+            statement["Operating Income"][period] = round(period_revenue * (margin + 0.05), 2)
+            statement["Net Income"][period] = round(period_revenue * margin, 2)
+        return statement
+
+
+# 2. Persistent tier
+class DiskStore:
+    """SQLite-backed store shared by every process that points at the same file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS market_data ("
+                "ticker TEXT NOT NULL, field TEXT NOT NULL, payload TEXT NOT NULL, fetched_at REAL NOT NULL, "
+                "PRIMARY KEY (ticker, field))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, field: str, ticker: str):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT payload, fetched_at FROM market_data WHERE ticker = ? AND field = ?", (ticker, field)
+            ).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def changed_since(self, field: str, since: float) -> List[tuple]:
+        """(ticker, value, fetched_at) for every entry of `field` fetched after `since`."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT ticker, payload, fetched_at FROM market_data WHERE field = ? AND fetched_at > ?", (field, since)
+            ).fetchall()
+        return [(ticker, json.loads(payload), fetched_at) for ticker, payload, fetched_at in rows]
+
+    def missing(self, field: str, tickers: List[str]) -> List[str]:
+        """The given tickers, in order, with no entry of `field` at all, however old."""
+        stored = set()
+        with closing(self._connect()) as conn:
+            # Chunked to stay under SQLite's bound-parameter limit
+            for start in range(0, len(tickers), 500):
+                chunk = tickers[start:start + 500]
+                stored.update(row[0] for row in conn.execute(
+                    f"SELECT ticker FROM market_data WHERE field = ? AND ticker IN ({','.join('?' * len(chunk))})",
+                    (field, *chunk),
+                ))
+        return [ticker for ticker in tickers if ticker not in stored]
+
+    def put(self, field: str, ticker: str, value, fetched_at: float):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO market_data (ticker, field, payload, fetched_at) VALUES (?, ?, ?, ?)",
+                (ticker, field, json.dumps(value, default=str), fetched_at),
+            )
+
+
+# 3. Two-tier cache in front of any provider
+class CachedMarketDataProvider(MarketDataProvider):
+    """
+    In-process LRU with per-field TTLs, backed by an optional DiskStore. Entries keep the
+    time they were fetched upstream, so an entry promoted from disk ages the same way.
+    """
+
+    def __init__(self, upstream: MarketDataProvider, ttls: Dict[str, float],
+                 max_entries: int = 1024, disk_store: Optional[DiskStore] = None):
+        self.upstream = upstream
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.disk_store = disk_store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _record(self, field: str, outcome: str, latency: Optional[float] = None):
+        with self._lock:
+            stats = self._stats.setdefault(field, {
+                "memory_hits": 0, "disk_hits": 0, "misses": 0,
+                "fetches": 0, "fetch_seconds_total": 0.0, "fetch_seconds_max": 0.0,
+            })
+            stats[outcome] += 1
+            if latency is not None:
+                stats["fetches"] += 1
+                stats["fetch_seconds_total"] += latency
+                stats["fetch_seconds_max"] = max(stats["fetch_seconds_max"], latency)
+
+    def _remember(self, key, value, fetched_at: float):
+        with self._lock:
+            self._entries[key] = (value, fetched_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _lookup(self, field: str, ticker: str):
+        """Returns (value, tier) for a fresh cached entry, promoting disk hits into memory."""
+        key = (field, ticker.upper())
+        ttl = self.ttls.get(field, 0)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[1] < ttl:
+                self._entries.move_to_end(key)
+                return entry[0], "memory_hits"
+        if self.disk_store:
+            stored = self.disk_store.get(field, key[1])
+            if stored and now - stored[1] < ttl:
+                self._remember(key, stored[0], stored[1])
+                return stored[0], "disk_hits"
+        return None
+
+    def _store(self, field: str, ticker: str, value):
+        fetched_at = time.time()
+        self._remember((field, ticker.upper()), value, fetched_at)
+        if self.disk_store:
+            self.disk_store.put(field, ticker.upper(), value, fetched_at)
+
+    def _get(self, field: str, ticker: str, fetch: Callable[[str], Any], refresh: bool = False):
+        if not refresh:
+            cached = self._lookup(field, ticker)
+            if cached:
+                self._record(field, cached[1])
+                return cached[0]
+
+        started = time.perf_counter()
+        value = fetch(ticker)
+        self._record(field, "misses", time.perf_counter() - started)
+        self._store(field, ticker, value)
+        return value
+
+    def get_info(self, ticker: str, refresh: bool = False) -> Dict[str, Any]:
+        return self._get("info", ticker, self.upstream.get_info, refresh)
+
+    def get_financials(self, ticker: str, refresh: bool = False) -> Statement:
+        return self._get("financials", ticker, self.upstream.get_financials, refresh)
+
+    def prefetch(self, tickers: List[str], refresh: bool = False) -> Dict[str, int]:
+        """
+        Loads every field for all tickers with one bulk upstream call per field, skipping
+        tickers that are already cached. Returns how many tickers were fetched per field.
+        """
+        fetched = {}
+        for field in ("info", "financials"):
+            missing = [ticker for ticker in tickers if refresh or self._lookup(field, ticker) is None]
+            if not missing:
+                fetched[field] = 0
+                continue
+            started = time.perf_counter()
+            values = self.upstream.get_many(field, missing)
+            elapsed = time.perf_counter() - started
+            for ticker, value in values.items():
+                self._record(field, "misses", elapsed / len(missing))
+                self._store(field, ticker, value)
+            fetched[field] = len(values)
+        return fetched
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            report = {}
+            for field, stats in self._stats.items():
+                lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+                report[field] = dict(
+                    stats,
+                    hit_rate=(stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0,
+                    fetch_seconds_avg=stats["fetch_seconds_total"] / stats["fetches"] if stats["fetches"] else 0.0,
+                )
+            report["entries"] = len(self._entries)
+            return report
+
+
+_provider: Optional[MarketDataProvider] = None
+_provider_lock = threading.Lock()
+
+
+def build_market_data_provider(upstream: Optional[MarketDataProvider] = None) -> CachedMarketDataProvider:
+    disk_store = None
+    if settings.MARKET_DATA_CACHE_PATH:
+        directory = os.path.dirname(settings.MARKET_DATA_CACHE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        disk_store = DiskStore(settings.MARKET_DATA_CACHE_PATH)
+    return CachedMarketDataProvider(
+        upstream or YFinanceProvider(),
+        ttls={
+            "info": settings.MARKET_DATA_INFO_TTL_SECONDS,
+            "financials": settings.MARKET_DATA_FINANCIALS_TTL_SECONDS,
+        },
+        max_entries=settings.MARKET_DATA_CACHE_MAX_ENTRIES,
+        disk_store=disk_store,
+    )
+
+
+def get_market_data_provider() -> MarketDataProvider:
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = build_market_data_provider()
+        return _provider
+
+
+def current_market_data_provider() -> Optional[MarketDataProvider]:
+    """The process-wide provider if one has been built, without building it."""
+    return _provider
+
+
+def set_market_data_provider(provider: MarketDataProvider):
+    """Replaces the process-wide provider, e.g. with a FakeMarketDataProvider in tests."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
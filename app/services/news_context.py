@@ -0,0 +1,161 @@
+"""
+Turns raw news search results into a compact prompt context: near-duplicate snippets
+are dropped (word shingles + MinHash), the rest are ranked by relevance to the company
+and recency, and packed into a token budget.
+"""
+import hashlib
+import random
+import re
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import NEWS_CONTEXT_TOKENS
+
+SHINGLE_WORDS = 5
+NUM_PERMUTATIONS = 64
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+_WORD = re.compile(r"[a-z0-9]+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_MONTHS = {name: i + 1 for i, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+)}
+_ISO_DATE = re.compile(r"\b(20\d\d)-(\d\d)-(\d\d)\b")
+_TEXT_DATE = re.compile(r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+(\d{1,2}),?\s+(20\d\d)\b")
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly four characters per token, close enough for Gemini and GPT tokenizers on English text."""
+    return (len(text) + 3) // 4
+
+
+# 1. Near-duplicate detection
+def _shingles(text: str) -> set:
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def minhash(text: str) -> Tuple[int, ...]:
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+              for shingle in _shingles(text)]
+    if not hashes:
+        return tuple([_MERSENNE_PRIME] * NUM_PERMUTATIONS)
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(signature_a: Tuple[int, ...], signature_b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the two snippets' shingle sets."""
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / NUM_PERMUTATIONS
+
+
+# 2. Ranking
+def _latest_date(text: str) -> Optional[date]:
+    found = []
+    lowered = text.lower()
+    for year, month, day in _ISO_DATE.findall(lowered):
+        found.append((int(year), int(month), int(day)))
+    for month, day, year in _TEXT_DATE.findall(lowered):
+        found.append((int(year), _MONTHS[month[:3]], int(day)))
+    dates = []
+    for year, month, day in found:
+        try:
+            dates.append(date(year, month, day))
+        except ValueError:
+            continue
+    return max(dates) if dates else None
+
+
+def _relevance(text: str, terms: Iterable[str]) -> float:
+    words = _WORD.findall(text.lower())
+    if not words:
+        return 0.0
+    hits = sum(1 for word in words if word in terms)
+    return min(1.0, hits / 3)
+
+
+def rank_snippets(snippets: List[Dict[str, Any]], ticker: str, company_name: Optional[str] = None,
+                  today: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    Orders snippets best first. The score mixes mentions of the ticker or company name,
+    the newest date found in the text, and the search engine's own order.
+    """
+    today = today or date.today()
+    terms = {ticker.lower()} | {
+        word for word in _WORD.findall((company_name or "").lower())
+        if len(word) > 2 and word not in {"inc", "corp", "corporation", "the", "company", "ltd", "plc", "holdings"}
+    }
+    scored = []
+    for position, snippet in enumerate(snippets):
+        published = _latest_date(snippet["content"])
+        recency = 0.5 if published is None else max(0.0, 1 - (today - published).days / 365)
+        order = 1 - position / max(len(snippets), 1)
+        score = 0.5 * _relevance(snippet["content"], terms) + 0.3 * recency + 0.2 * order
+        scored.append((score, -position, snippet))
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [snippet for _, _, snippet in scored]
+
+
+# 3. Packing
+def _truncate(text: str, max_tokens: int) -> str:
+    """Keeps whole sentences that fit; falls back to a hard cut if even the first one does not."""
+    kept = ""
+    for sentence in _SENTENCE_END.split(text):
+        candidate = f"{kept} {sentence}".strip()
+        if estimate_tokens(candidate) > max_tokens:
+            break
+        kept = candidate
+    return kept or text[:max_tokens * 4].rstrip()
+
+
+def build_news_context(results: List[Dict[str, Any]], ticker: str, budget_tokens: int,
+                       company_name: Optional[str] = None, prompt: str = "news") -> Tuple[str, Dict[str, Any]]:
+    """
+    Returns the packed context and stats: snippets kept, duplicates dropped, and the
+    token estimate before and after. A budget of 0 or less keeps everything that is not
+    a duplicate.
+    """
+    if not isinstance(results, list):
+        raise TypeError(f"Expected a list of search results, got {type(results).__name__}: {results!r:.200}")
+    snippets = [result for result in results if (result.get("content") or "").strip()]
+    raw_tokens = estimate_tokens("\n".join(snippet["content"] for snippet in snippets))
+
+    unique, signatures = [], []
+    for snippet in rank_snippets(snippets, ticker, company_name):
+        signature = minhash(snippet["content"])
+        if any(similarity(signature, other) >= settings.NEWS_DEDUPE_THRESHOLD for other in signatures):
+            continue
+        unique.append(snippet)
+        signatures.append(signature)
+
+    packed, used = [], 0
+    for snippet in unique:
+        content = snippet["content"].strip()
+        if budget_tokens > 0:
+            remaining = budget_tokens - used
+            if remaining <= 0:
+                break
+            if estimate_tokens(content) > remaining:
+                content = _truncate(content, remaining)
+                if not content:
+                    break
+        packed.append(content)
+        used += estimate_tokens(content) + 1
+
+    context = "\n".join(packed)
+    kept_tokens = estimate_tokens(context)
+    NEWS_CONTEXT_TOKENS.labels(prompt, "raw").inc(raw_tokens)
+    NEWS_CONTEXT_TOKENS.labels(prompt, "kept").inc(kept_tokens)
+    stats = {
+        "snippets": len(snippets),
+        "duplicates_dropped": len(snippets) - len(unique),
+        "snippets_kept": len(packed),
+        "raw_tokens": raw_tokens,
+        "context_tokens": kept_tokens,
+        "tokens_saved": max(0, raw_tokens - kept_tokens),
+    }
+    return context, stats
@@ -0,0 +1,101 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db import models
+from app.db.session import AsyncSessionLocal
+
+TERMINAL_STATUSES = ('completed', 'failed')
+
+
+class Subscription:
+    """One streaming client. Remembers what it has been sent so events are never repeated."""
+
+    def __init__(self, analysis_id: int):
+        self.analysis_id = analysis_id
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.sent_nodes: Set[str] = set()
+        self.last_status: Optional[str] = None
+        self.last_attempt: Optional[int] = None
+
+    def events_for(self, row) -> List[Dict[str, Any]]:
+        events = []
+        if row is None:
+            return [{"event": "error", "data": {"detail": "Analysis not found"}}]
+        # Every claim bumps attempts and starts the nodes over, so a retry is streamed from its first node
+        retried = self.last_attempt is not None and row.attempts != self.last_attempt
+        if retried:
+            self.sent_nodes.clear()
+        if (row.status != self.last_status or retried) and row.status not in TERMINAL_STATUSES:
+            events.append({"event": "status", "data": {"analysis_id": row.id, "status": row.status,
+                                                        "attempt": row.attempts}})
+        for node, update in (row.progress_json or {}).items():
+            if node not in self.sent_nodes:
+                self.sent_nodes.add(node)
+                events.append({"event": "node", "data": {"analysis_id": row.id, "node": node, "output": update}})
+        if row.status == 'completed':
+            events.append({"event": "completed", "data": {"analysis_id": row.id, "result": row.result_json}})
+        elif row.status == 'failed':
+            events.append({"event": "failed", "data": {"analysis_id": row.id, "error": row.error}})
+        self.last_status = row.status
+        self.last_attempt = row.attempts
+        return events
+
+
+class ProgressHub:
+    """
+    Fans analysis progress out to streaming clients. However many clients are connected,
+    the hub reads the watched AnalysisLog rows with one query per tick, so the database
+    sees a constant load instead of one poll per client.
+    """
+
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, analysis_id: int) -> Subscription:
+        subscription = Subscription(analysis_id)
+        self._subscriptions.setdefault(analysis_id, set()).add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        watchers = self._subscriptions.get(subscription.analysis_id)
+        if watchers is not None:
+            watchers.discard(subscription)
+            if not watchers:
+                del self._subscriptions[subscription.analysis_id]
+
+    async def _fetch(self, analysis_ids: List[int]):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(
+                models.AnalysisLog.id, models.AnalysisLog.status, models.AnalysisLog.attempts, models.AnalysisLog.progress_json,
+                models.AnalysisLog.result_json, models.AnalysisLog.error,
+            ).where(models.AnalysisLog.id.in_(analysis_ids)))
+            return result.all()
+
+    async def _run(self):
+        while self._subscriptions:
+            analysis_ids = list(self._subscriptions)
+            try:
+                rows = {row.id: row for row in await self._fetch(analysis_ids)}
+            except Exception as e:
+                print(f"Progress poll failed: {e}")
+                rows = None
+            if rows is not None:
+                for analysis_id in analysis_ids:
+                    for subscription in list(self._subscriptions.get(analysis_id, ())):
+                        for event in subscription.events_for(rows.get(analysis_id)):
+                            subscription.queue.put_nowait(event)
+            await asyncio.sleep(self.poll_interval)
+
+
+progress_hub = ProgressHub(settings.PROGRESS_POLL_INTERVAL_SECONDS)
+
+
+def is_final_event(event: Dict[str, Any]) -> bool:
+    return event["event"] in ('completed', 'failed', 'error')
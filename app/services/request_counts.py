@@ -0,0 +1,78 @@
+"""
+Per-company analysis request counts for the cache-warming scheduler.
+
+Requests are counted in memory and added to the daily company_request_counts rows every
+REQUEST_COUNTS_FLUSH_SECONDS, so a burst on one ticker costs one upsert per flush rather
+than a write on the hottest row for every request.
+"""
+import asyncio
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, Optional
+
+import pytz
+
+from app.core.config import settings
+from app.db import models
+from app.db.session import AsyncSessionLocal, async_engine, dialect_insert
+
+
+class RequestCounter:
+    def __init__(self):
+        self._pending: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, company_ids: Iterable[int]):
+        day = datetime.now(pytz.utc).date()
+        for company_id in company_ids:
+            self._pending[(company_id, day)] += 1
+
+    async def flush(self):
+        pending, self._pending = self._pending, Counter()
+        if not pending:
+            return
+        counts = models.CompanyRequestCount.__table__
+        insert = dialect_insert(async_engine.dialect.name)
+        statement = insert(counts).values([
+            {"company_id": company_id, "day": day, "count": count} for (company_id, day), count in pending.items()
+        ])
+        statement = statement.on_conflict_do_update(
+            index_elements=[counts.c.company_id, counts.c.day],
+            set_={"count": counts.c.count + statement.excluded.count},
+        )
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(statement)
+                await db.commit()
+        except Exception:
+            # Keep the counts for the next flush
+            self._pending.update(pending)
+            raise
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.REQUEST_COUNTS_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Request count flush failed: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Request count flush failed: {e}")
+
+
+request_counter = RequestCounter()
@@ -0,0 +1,252 @@
+import asyncio
+import math
+import re
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.core.http import get_http_client
+from app.core.outbound import call
+from app.db import models
+from app.db.session import AsyncSessionLocal
+
+FMP_STOCK_LIST_URL = "https://financialmodelingprep.com/api/v3/stock/list"
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TickerIndex:
+    """
+    In-memory index over ticker symbols and company names. Prefix lookups are binary
+    searches over sorted keys; fuzzy lookups use a trigram inverted index. Built in one
+    go from the listing, then extended in place with add() as companies appear.
+    """
+
+    def __init__(self, entries: Iterable[Dict[str, str]] = ()):
+        self.entries: List[Dict[str, str]] = []
+        self._seen = set()
+        for entry in entries:
+            self._append(entry)
+
+        self._symbols = sorted((entry["ticker_symbol"].lower(), i) for i, entry in enumerate(self.entries))
+        self._tokens = sorted(
+            (token, i) for i, entry in enumerate(self.entries) for token in set(_TOKEN_RE.findall(entry["name"].lower()))
+        )
+        # Posting lists stay sorted by entry position, which _fuzzy_matches relies on
+        self._trigrams: Dict[str, List[int]] = defaultdict(list)
+        self._trigram_counts: List[int] = []
+        for i, entry in enumerate(self.entries):
+            self._index_trigrams(i, entry)
+
+    def _append(self, entry: Dict[str, str]) -> Optional[int]:
+        symbol = (entry.get("ticker_symbol") or "").strip()
+        if not symbol or symbol.upper() in self._seen:
+            return None
+        self._seen.add(symbol.upper())
+        self.entries.append({"name": (entry.get("name") or symbol).strip(), "ticker_symbol": symbol})
+        return len(self.entries) - 1
+
+    def _index_trigrams(self, i: int, entry: Dict[str, str]):
+        grams = _trigrams(entry["name"].lower()) | _trigrams(entry["ticker_symbol"].lower())
+        self._trigram_counts.append(len(grams))
+        for gram in grams:
+            self._trigrams[gram].append(i)
+
+    def add(self, entries: Iterable[Dict[str, str]]) -> int:
+        """
+        Adds entries whose symbol is not indexed yet; returns how many. Not thread-safe:
+        call it from the thread that searches, which is cheap for the few new companies
+        a refresh brings, instead of rebuilding the whole index.
+        """
+        added = 0
+        for entry in entries:
+            i = self._append(entry)
+            if i is None:
+                continue
+            entry = self.entries[i]
+            insort(self._symbols, (entry["ticker_symbol"].lower(), i))
+            for token in set(_TOKEN_RE.findall(entry["name"].lower())):
+                insort(self._tokens, (token, i))
+            self._index_trigrams(i, entry)
+            added += 1
+        return added
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _prefix_matches(keys, prefix: str, limit: int):
+        matches = []
+        position = bisect_left(keys, (prefix, -1))
+        while position < len(keys) and keys[position][0].startswith(prefix) and len(matches) < limit:
+            matches.append(keys[position])
+            position += 1
+        return matches
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, str]]:
+        query = query.strip().lower()
+        if not query or not self.entries:
+            return []
+
+        scores: Dict[int, float] = {}
+
+        def offer(index: int, score: float):
+            if score > scores.get(index, 0):
+                scores[index] = score
+
+        # Symbol prefixes rank highest, exact symbols above everything
+        for symbol, i in self._prefix_matches(self._symbols, query, limit * 5):
+            offer(i, 3.0 if symbol == query else 2.0 + 1 / (1 + len(symbol) - len(query)))
+
+        # Then any word of the company name starting with the query
+        for token, i in self._prefix_matches(self._tokens, query, limit * 5):
+            offer(i, 1.5 + 1 / (1 + len(token) - len(query)))
+
+        # Fuzzy fallback for typos: share of the query's trigrams found in the entry
+        if len(scores) < limit and len(query) >= 3:
+            for i, similarity in self._fuzzy_matches(query):
+                # Prefer shorter entries among equally good matches
+                offer(i, similarity - self._trigram_counts[i] / 10000)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], len(self.entries[item[0]]["ticker_symbol"])))
+        return [self.entries[i] for i, _ in ranked[:limit]]
+
+    def _fuzzy_matches(self, query: str) -> List[tuple]:
+        """
+        (entry, share of the query's trigrams it contains) for entries at or above
+        TICKER_INDEX_FUZZY_THRESHOLD, without walking the posting lists of common
+        trigrams such as "inc" or "  a", which cover a large part of the listing.
+        """
+        grams = sorted(_trigrams(query), key=lambda gram: len(self._trigrams.get(gram, ())))
+        needed = max(1, math.ceil(settings.TICKER_INDEX_FUZZY_THRESHOLD * len(grams)))
+        # An entry holding `needed` of the grams holds at least one of any len(grams) - needed + 1
+        # of them, so collecting candidates from that many of the rarest finds every match.
+        # When even those are too common, the first candidates up to the budget are scored.
+        budget = settings.TICKER_INDEX_FUZZY_MAX_CANDIDATES
+        shared: Dict[int, int] = {}
+        scanned = 0
+        for gram in grams[:len(grams) - needed + 1]:
+            postings = self._trigrams.get(gram, [])
+            room = budget - len(shared)
+            if len(postings) > room:
+                # Counted with the rest below, so take its entries as candidates without a hit
+                for i in postings[:room]:
+                    shared.setdefault(i, 0)
+                break
+            for i in postings:
+                shared[i] = shared.get(i, 0) + 1
+            scanned += 1
+
+        # Count the remaining grams by binary search in their sorted posting lists,
+        # giving up on a candidate as soon as it can no longer reach `needed`
+        rest = [self._trigrams.get(gram, []) for gram in grams[scanned:]]
+        matches = []
+        for i, count in shared.items():
+            missing_allowed = count + len(rest) - needed
+            for postings in rest:
+                position = bisect_left(postings, i)
+                if position < len(postings) and postings[position] == i:
+                    count += 1
+                else:
+                    missing_allowed -= 1
+                    if missing_allowed < 0:
+                        break
+            if count >= needed:
+                matches.append((i, count / len(grams)))
+        return matches
+
+
+class TickerIndexService:
+    """Holds the current index and rebuilds it from the companies table and the FMP symbol listing."""
+
+    def __init__(self):
+        self.index = TickerIndex()
+        self._listing: List[Dict[str, str]] = []
+        self._listing_fetched_at = 0.0
+        self._remembered: Dict[str, Dict[str, str]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, str]]:
+        return self.index.search(query, limit)
+
+    def remember(self, entries: Iterable[Dict[str, str]]):
+        """Keeps entries found upstream so they are part of the next rebuild."""
+        for entry in entries:
+            self._remembered[entry["ticker_symbol"].upper()] = entry
+
+    async def _load_companies(self) -> List[Dict[str, str]]:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(models.Company.name, models.Company.ticker_symbol).where(
+                models.Company.ticker_symbol.isnot(None)
+            ))
+            return [{"name": row.name, "ticker_symbol": row.ticker_symbol} for row in result.all()]
+
+    async def _fetch_listing(self) -> List[Dict[str, str]]:
+        client = get_http_client()
+
+        async def fetch():
+            response = await client.get(FMP_STOCK_LIST_URL, params={"apikey": settings.FINANCIAL_MODELING_PREP_API_KEY})
+            response.raise_for_status()
+            return response
+
+        response = await call("fmp", "stock-list", fetch)
+        return [
+            {"name": item.get("name") or item["symbol"], "ticker_symbol": item["symbol"]}
+            for item in response.json() if item.get("symbol")
+        ]
+
+    async def refresh(self):
+        companies = await self._load_companies()
+        listing_fetched = False
+        if time.monotonic() - self._listing_fetched_at > settings.TICKER_INDEX_LISTING_REFRESH_SECONDS or not self._listing:
+            try:
+                self._listing = await self._fetch_listing()
+                self._listing_fetched_at = time.monotonic()
+                listing_fetched = True
+            except Exception as e:
+                print(f"Ticker listing refresh failed: {e}")
+        # Listing names win over companies created on the fly by start-analysis, which
+        # only carry the ticker as their name
+        extra = list(self._remembered.values()) + companies
+        if listing_fetched or not len(self.index):
+            # Building ~100k entries takes seconds of CPU; only when the listing changed, off
+            # the event loop, swapped in atomically
+            self.index = await asyncio.to_thread(TickerIndex, self._listing + extra)
+            print(f"Ticker index rebuilt with {len(self.index)} symbols")
+        else:
+            # Between listing fetches only companies and upstream finds appear: add them in place
+            added = self.index.add(extra)
+            if added:
+                print(f"Ticker index: added {added} symbol(s), {len(self.index)} total")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Ticker index refresh failed: {e}")
+            await asyncio.sleep(settings.TICKER_INDEX_REFRESH_SECONDS)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+ticker_index = TickerIndexService()
@@ -0,0 +1,249 @@
+"""
+Analysis worker. Claims pending AnalysisLog and AnalysisBatch rows and runs the AI
+workflow for them.
+
+    python -m app.worker [--processes N] [--concurrency M] [--metrics-port P]
+
+Each process runs up to M jobs at a time (a batch counts as one job and limits its own
+fan-out); start as many processes (or hosts) as the LLM quota allows. Jobs survive
+restarts because the queue lives in the database. With --metrics-port, process i serves
+Prometheus metrics on port P + i.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import start_http_server
+
+from app.core.config import settings
+from app.core.metrics import ANALYSIS_JOBS
+from app.core.outbound import RETRYABLE, classify_error
+from app.db import models
+from app.db.session import SessionLocal
+from app.services.market_data import get_market_data_provider
+from app.services.analysis_jobs import (
+    claim_next_analysis, claim_next_batch, complete_analysis, fail_job, fail_unfinished_children,
+    finish_batch, heartbeat_jobs, previous_intermediates, reap_stale_jobs, record_progress,
+)
+
+REAP_INTERVAL_SECONDS = 60
+# Batch children that fail with these go back to pending for the batch's next attempt
+RETRYABLE_CHILD_ERRORS = RETRYABLE + ("circuit_open",)
+
+
+def save_progress(analysis_id: int, worker_id: str, node: str, update: dict):
+    db = SessionLocal()
+    try:
+        record_progress(db, analysis_id, worker_id, node, update)
+    finally:
+        db.close()
+
+
+def run_job(analysis_id: int, worker_id: str):
+    # Imported here so the parent process of a multi-process worker stays light
+    from app.services.ai_workflow import run_analysis
+
+    db = SessionLocal()
+    try:
+        log = db.get(models.AnalysisLog, analysis_id)
+        ticker = log.company.ticker_symbol
+        print(f"Starting AI task for log {analysis_id} ({ticker}, attempt {log.attempts})")
+
+        async def on_progress(node, update):
+            await asyncio.to_thread(save_progress, analysis_id, worker_id, node, update)
+
+        previous = previous_intermediates(db, [log.company_id]).get(log.company_id)
+        result, intermediates = run_analysis(ticker, on_progress, previous)
+        if not complete_analysis(db, analysis_id, worker_id, json.loads(json.dumps(result)),
+                                 json.loads(json.dumps(intermediates))):
+            print(f"Dropped result for log {analysis_id}: the job was reclaimed by another worker")
+            return
+        ANALYSIS_JOBS.labels("analysis", "completed").inc()
+        print(f"Completed AI task for log {analysis_id}")
+    except Exception as e:
+        print(f"AI task failed for log {analysis_id}: {e}")
+        ANALYSIS_JOBS.labels("analysis", "failed").inc()
+        db.rollback()
+        fail_job(db, models.AnalysisLog, analysis_id, worker_id, str(e))
+    finally:
+        db.close()
+
+
+def run_batch_job(batch_id: int, worker_id: str):
+    from app.services.ai_workflow import arun_batch_analysis, run_in_background_loop
+
+    db = SessionLocal()
+    try:
+        batch = db.get(models.AnalysisBatch, batch_id)
+        unfinished = [child for child in batch.analyses if child.status in ('pending', 'running')]
+        children = {child.company.ticker_symbol: child.id for child in unfinished}
+        intermediates_by_company = previous_intermediates(db, [child.company_id for child in unfinished])
+        previous = {
+            child.company.ticker_symbol: intermediates_by_company[child.company_id]
+            for child in unfinished if child.company_id in intermediates_by_company
+        }
+        print(f"Starting batch {batch_id} with {len(children)} ticker(s), attempt {batch.attempts}")
+        db.query(models.AnalysisLog).filter(models.AnalysisLog.id.in_(list(children.values()))).update(
+            {"status": 'running', "worker_id": worker_id, "attempts": models.AnalysisLog.attempts + 1,
+             "progress_json": None},
+            synchronize_session=False,
+        )
+        db.commit()
+
+        def finish_child(ticker, report, error, intermediates):
+            child_db = SessionLocal()
+            try:
+                if error is None:
+                    if complete_analysis(child_db, children[ticker], worker_id, json.loads(json.dumps(report)),
+                                         json.loads(json.dumps(intermediates))):
+                        ANALYSIS_JOBS.labels("analysis", "completed").inc()
+                else:
+                    retry = classify_error(error) in RETRYABLE_CHILD_ERRORS
+                    print(f"AI task failed for log {children[ticker]} in batch {batch_id}"
+                          f"{' (will retry)' if retry else ''}: {error}")
+                    ANALYSIS_JOBS.labels("analysis", "failed").inc()
+                    fail_job(child_db, models.AnalysisLog, children[ticker], worker_id, str(error), retry=retry)
+            finally:
+                child_db.close()
+
+        async def on_result(ticker, report, error, intermediates):
+            await asyncio.to_thread(finish_child, ticker, report, error, intermediates)
+
+        async def on_progress(ticker, node, update):
+            await asyncio.to_thread(save_progress, children[ticker], worker_id, node, update)
+
+        run_in_background_loop(arun_batch_analysis(list(children), on_result, on_progress, previous))
+
+        db.expire_all()
+        status = finish_batch(db, batch_id, worker_id)
+        if status is None:
+            print(f"Batch {batch_id} was reclaimed by another worker; leaving it to them")
+            return
+        if status != 'pending':
+            ANALYSIS_JOBS.labels("batch", status).inc()
+        print(f"Batch {batch_id} {'requeued for a retry' if status == 'pending' else status}")
+    except Exception as e:
+        print(f"Batch {batch_id} failed: {e}")
+        ANALYSIS_JOBS.labels("batch", "failed").inc()
+        db.rollback()
+        if fail_job(db, models.AnalysisBatch, batch_id, worker_id, str(e)) == 'failed':
+            fail_unfinished_children(db, [batch_id], str(e))
+            db.commit()
+    finally:
+        db.close()
+
+
+def log_market_data_stats():
+    provider = get_market_data_provider()
+    if hasattr(provider, "stats"):
+        print(f"Market data cache: {json.dumps(provider.stats())}")
+
+
+def warm_up_workflow():
+    # Import the AI stack, compile the graph and build the clients before claiming work,
+    # so the first job is not slower than the rest
+    started = time.perf_counter()
+    try:
+        from app.services.ai_workflow import warm_up
+        warm_up()
+    except Exception as e:
+        print(f"AI workflow warm-up failed, continuing cold: {e}")
+        return
+    print(f"AI workflow warmed up in {time.perf_counter() - started:.2f}s")
+
+
+def worker_loop(concurrency: int, poll_interval: float, metrics_port: int = 0, warm_up: bool = True):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    if warm_up:
+        warm_up_workflow()
+    if metrics_port:
+        start_http_server(metrics_port)
+        print(f"Worker {worker_id} serving metrics on port {metrics_port}")
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    print(f"Worker {worker_id} started with concurrency {concurrency}")
+    # (model, job id) -> future
+    running = {}
+    last_reap = 0.0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while not stopping:
+            running = {job: future for job, future in running.items() if not future.done()}
+
+            db = SessionLocal()
+            try:
+                for model in (models.AnalysisLog, models.AnalysisBatch):
+                    heartbeat_jobs(db, model, [job_id for job_model, job_id in running if job_model is model], worker_id)
+                if time.monotonic() - last_reap > REAP_INTERVAL_SECONDS:
+                    reap_stale_jobs(db)
+                    log_market_data_stats()
+                    last_reap = time.monotonic()
+                while len(running) < concurrency:
+                    batch = claim_next_batch(db, worker_id)
+                    if batch:
+                        running[(models.AnalysisBatch, batch.id)] = executor.submit(run_batch_job, batch.id, worker_id)
+                        continue
+                    log = claim_next_analysis(db, worker_id)
+                    if not log:
+                        break
+                    running[(models.AnalysisLog, log.id)] = executor.submit(run_job, log.id, worker_id)
+            except Exception as e:
+                print(f"Worker {worker_id} poll failed: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+            time.sleep(poll_interval)
+
+        print(f"Worker {worker_id} stopping, waiting for {len(running)} running job(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run analysis workers")
+    parser.add_argument("--processes", type=int, default=settings.WORKER_PROCESSES)
+    parser.add_argument("--concurrency", type=int, default=settings.WORKER_CONCURRENCY)
+    parser.add_argument("--poll-interval", type=float, default=settings.WORKER_POLL_INTERVAL_SECONDS)
+    parser.add_argument("--metrics-port", type=int, default=settings.WORKER_METRICS_PORT, help="0 disables")
+    parser.add_argument("--no-warm-up", dest="warm_up", action="store_false", default=settings.WORKER_WARM_UP,
+                        help="load the AI stack on the first job instead of at startup")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        worker_loop(args.concurrency, args.poll_interval, args.metrics_port, args.warm_up)
+        return
+
+    processes = [
+        multiprocessing.Process(
+            target=worker_loop,
+            args=(args.concurrency, args.poll_interval, args.metrics_port + i if args.metrics_port else 0, args.warm_up),
+        )
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    def forward_stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, forward_stop)
+    signal.signal(signal.SIGINT, forward_stop)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
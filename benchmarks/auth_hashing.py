@@ -0,0 +1,87 @@
+"""
+Password hashing micro-benchmark.
+
+    python -m benchmarks.auth_hashing [--requests 200] [--concurrency 50] [--rounds 12]
+
+Simulates a burst of concurrent logins on one event loop, first with bcrypt called
+inline (the old behaviour) and then through PasswordHasher. Reports verifications per
+second, per core, and how long the event loop was blocked in each mode.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from benchmarks.common import configure_environment
+
+
+async def run_burst(verify, requests: int, concurrency: int):
+    from app.core.loop_monitor import EventLoopMonitor
+
+    monitor = EventLoopMonitor(interval=0.01, blocked_threshold=0.05)
+    monitor.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await verify()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+    return elapsed, monitor.stats()
+
+
+async def main_async(args):
+    from app.core.security import PasswordHasher, pwd_context
+
+    password = "correct horse battery staple"
+    hashed = pwd_context.hash(password)
+    cores = os.cpu_count() or 1
+    report = {"rounds": args.rounds, "requests": args.requests, "concurrency": args.concurrency, "cores": cores}
+
+    async def inline_verify():
+        pwd_context.verify(password, hashed)
+
+    elapsed, loop_stats = await run_burst(inline_verify, args.requests, args.concurrency)
+    report["inline"] = {
+        "seconds": elapsed,
+        "verifications_per_second": args.requests / elapsed,
+        "verifications_per_second_per_core": args.requests / elapsed / cores,
+        "event_loop": loop_stats,
+    }
+
+    for workers in sorted({1, cores, args.workers or cores}):
+        hasher = PasswordHasher(workers=workers, max_pending=args.requests)
+
+        async def pooled_verify():
+            await hasher.verify_and_update(password, hashed)
+
+        elapsed, loop_stats = await run_burst(pooled_verify, args.requests, args.concurrency)
+        hasher.shutdown()
+        report[f"pool_{workers}_workers"] = {
+            "seconds": elapsed,
+            "verifications_per_second": args.requests / elapsed,
+            "verifications_per_second_per_core": args.requests / elapsed / min(workers, cores),
+            "event_loop": loop_stats,
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=0, help="extra pool size to try (default: cpu count)")
+    args = parser.parse_args()
+    # Hash and verify at the benchmarked cost so verify_and_update never re-hashes
+    configure_environment("sqlite:///:memory:", BCRYPT_ROUNDS=args.rounds)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
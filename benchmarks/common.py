@@ -0,0 +1,114 @@
+import math
+import os
+import subprocess
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+# app.core.config requires every key to be set; benchmarks never reach the real services
+DUMMY_ENVIRONMENT = {
+    "JWT_SECRET_KEY": "benchmark",
+    "JWT_ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+    "REFRESH_TOKEN_EXPIRE_DAYS": "7",
+    "GOOGLE_API_KEY": "benchmark",
+    "TAVILY_API_KEY": "benchmark",
+    "FINANCIAL_MODELING_PREP_API_KEY": "benchmark",
+    "EMAIL_API_KEY": "benchmark",
+    "SENDER_EMAIL": "benchmark@example.com",
+}
+
+
+def configure_environment(database_url: str, **overrides: str):
+    """Must run before anything under `app` is imported."""
+    os.environ["DATABASE_URL"] = database_url
+    for key, value in DUMMY_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    for key, value in overrides.items():
+        os.environ[key] = str(value)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower, upper = math.floor(position), math.ceil(position)
+    if lower == upper:
+        return sorted_values[lower]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class Recorder:
+    """Collects latencies and errors per metric name and summarises them."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.error_samples: Dict[str, str] = {}
+        self.windows: Dict[str, List[float]] = {}
+
+    def record(self, name: str, seconds: float, ok: bool = True, error: Optional[str] = None):
+        self.latencies[name].append(seconds)
+        if not ok:
+            self.errors[name] += 1
+            self.error_samples.setdefault(name, error or "unknown error")
+        now = time.perf_counter()
+        window = self.windows.setdefault(name, [now - seconds, now])
+        window[0] = min(window[0], now - seconds)
+        window[1] = max(window[1], now)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        report = {}
+        for name, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            wall = self.windows[name][1] - self.windows[name][0]
+            report[name] = {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "mean_ms": sum(values) / len(values) * 1000,
+                "p50_ms": percentile(ordered, 0.50) * 1000,
+                "p95_ms": percentile(ordered, 0.95) * 1000,
+                "p99_ms": percentile(ordered, 0.99) * 1000,
+                "max_ms": ordered[-1] * 1000,
+                "rps": len(values) / wall if wall > 0 else 0.0,
+            }
+            if name in self.error_samples:
+                report[name]["first_error"] = self.error_samples[name]
+        return report
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def error_lines(report: Dict) -> List[str]:
+    """One line per metric that recorded failures; a run with any of these is not a valid measurement."""
+    lines = []
+    for section, metrics in report.items():
+        if not isinstance(metrics, dict):
+            continue
+        for name, values in metrics.items():
+            if isinstance(values, dict) and values.get("errors"):
+                lines.append(f"{section}/{name}: {values['errors']}/{values['count']} failed, "
+                             f"first: {values.get('first_error', 'unknown error')}")
+    return lines
+
+
+def compare(current: Dict, baseline: Dict) -> List[str]:
+    """Human-readable p95 / rps deltas for metrics present in both reports."""
+    lines = []
+    for section in ("endpoints", "nodes", "analysis"):
+        for name, metrics in current.get(section, {}).items():
+            before = baseline.get(section, {}).get(name)
+            if not before:
+                continue
+            p95_change = (metrics["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+            rps_change = (metrics["rps"] - before["rps"]) / before["rps"] * 100 if before["rps"] else 0.0
+            lines.append(f"{section}/{name}: p95 {before['p95_ms']:.1f} -> {metrics['p95_ms']:.1f} ms ({p95_change:+.1f}%), "
+                         f"rps {before['rps']:.1f} -> {metrics['rps']:.1f} ({rps_change:+.1f}%)")
+    return lines
@@ -0,0 +1,300 @@
+"""
+Offline end-to-end benchmark. Runs without API keys or network access: yfinance,
+Tavily, Gemini, FMP and restcountries are replaced by local fakes with configurable
+latency, and the database is a throwaway SQLite file.
+
+    python -m benchmarks.e2e [--users 50] [--searches 500] [--analyses 40] \
+        [--concurrency 20] [--llm-latency 0.5] [--output results.json] [--baseline old.json]
+
+Scenarios, in order:
+  auth      signup + login for --users accounts
+  search    --searches company-search requests (prefixes, full names and typos)
+  analysis  --analyses start-analysis requests over a small ticker set, processed by
+            in-process worker threads, with clients polling analysis-status
+  graph     --graph-runs direct arun_analysis calls, timed per graph node
+
+The JSON report has p50/p95/p99 latency and requests per second per endpoint, per
+graph node and for end-to-end analyses. Pass --baseline to print the change against
+an earlier report.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import Recorder, compare, configure_environment, error_lines, git_revision
+from benchmarks.fakes import COMPANY_NAMES, TICKERS, FakeSearchTool, fake_http_transport
+
+# Predecessors of each node in the analysis graph, used to turn completion times into durations
+GRAPH_PREDECESSORS = {
+    "data_collector": [],
+    "financial_analyst": ["data_collector"],
+    "market_analyst": ["data_collector"],
+    "final_advisor": ["financial_analyst", "market_analyst"],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--searches", type=int, default=500)
+    parser.add_argument("--analyses", type=int, default=40)
+    parser.add_argument("--graph-runs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4, help="in-process analysis worker threads")
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--yfinance-latency", type=float, default=0.3)
+    parser.add_argument("--tavily-latency", type=float, default=0.5)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--fast-llm-latency", type=float, default=None,
+                        help="latency of *-flash-* models (the analysts' default tier); defaults to --llm-latency")
+    parser.add_argument("--http-latency", type=float, default=0.1, help="FMP and restcountries")
+    parser.add_argument("--listing-size", type=int, default=5000, help="symbols in the fake FMP listing")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--outbound-rate", type=float, default=1000.0,
+                        help="per-provider rate limit in req/s; the production defaults would cap the fakes")
+    parser.add_argument("--warm-caches", action="store_true", help="keep market-data, LLM and result caches enabled")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own log output")
+    return parser.parse_args()
+
+
+async def timed(recorder: Recorder, name: str, call):
+    started = time.perf_counter()
+    try:
+        response = await call()
+        ok = response.status_code < 400
+        error = None if ok else f"HTTP {response.status_code}: {response.text[:200]}"
+    except Exception as e:
+        response, ok, error = None, False, f"{type(e).__name__}: {e}"
+    recorder.record(name, time.perf_counter() - started, ok, error)
+    return response
+
+
+async def bounded(concurrency: int, coroutines):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(coroutine) for coroutine in coroutines))
+
+
+async def scenario_auth(client, endpoints: Recorder, args):
+    async def account(i):
+        email = f"user{i}@benchmark.example.com"
+        await timed(endpoints, "POST /api/auth/signup", lambda: client.post(
+            "/api/auth/signup", json={"name": f"User {i}", "email": email, "password": "benchmark-password"}))
+        await timed(endpoints, "POST /api/auth/login", lambda: client.post(
+            "/api/auth/login", data={"username": email, "password": "benchmark-password"}))
+
+    await bounded(args.concurrency, [account(i) for i in range(args.users)])
+    await bounded(args.concurrency, [
+        timed(endpoints, "GET /api/data/countries", lambda: client.get("/api/data/countries")) for _ in range(args.concurrency)
+    ])
+
+
+async def scenario_search(client, endpoints: Recorder, args):
+    queries = []
+    for ticker, name in zip(TICKERS, COMPANY_NAMES):
+        queries += [ticker[:1], ticker[:2], ticker, name.split()[0], name.split()[0][:-1] + "x"]
+    requests = [queries[i % len(queries)] for i in range(args.searches)]
+    await bounded(args.concurrency, [
+        timed(endpoints, "GET /api/data/search-companies", lambda q=query: client.get(
+            "/api/data/search-companies", params={"query": q}))
+        for query in requests
+    ])
+
+
+def worker_thread(stop: threading.Event, worker_id: str):
+    from app.db.session import SessionLocal
+    from app.services.analysis_jobs import claim_next_analysis
+    from app.worker import run_job
+
+    while not stop.is_set():
+        db = SessionLocal()
+        try:
+            log = claim_next_analysis(db, worker_id)
+        finally:
+            db.close()
+        if log:
+            run_job(log.id, worker_id)
+        else:
+            stop.wait(0.05)
+
+
+async def scenario_analysis(client, endpoints: Recorder, analysis: Recorder, args):
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker_thread, args=(stop, f"benchmark:{i}"), daemon=True) for i in range(args.workers)]
+    for thread in threads:
+        thread.start()
+
+    async def request(i):
+        ticker = TICKERS[i % len(TICKERS)]
+        started = time.perf_counter()
+        response = await timed(endpoints, "POST /api/analysis/start-analysis", lambda: client.post(
+            "/api/analysis/start-analysis", params={"ticker": ticker}))
+        if response is None or response.status_code >= 400:
+            analysis.record("time_to_result", time.perf_counter() - started, ok=False, error="start-analysis failed")
+            return
+        body = response.json()
+        status, detail = body.get("status"), body
+        while status not in ("completed", "failed"):
+            await asyncio.sleep(args.poll_interval)
+            poll = await timed(endpoints, "GET /api/analysis/analysis-status", lambda: client.get(
+                f"/api/analysis/analysis-status/{body['analysis_id']}"))
+            detail = poll.json() if poll is not None and poll.status_code < 400 else {}
+            status = detail.get("status", "failed")
+        analysis.record("time_to_result", time.perf_counter() - started, ok=status == "completed",
+                        error=f"analysis {status}: {detail.get('error')}")
+
+    try:
+        await bounded(args.concurrency, [request(i) for i in range(args.analyses)])
+    finally:
+        stop.set()
+        for thread in threads:
+            await asyncio.to_thread(thread.join)
+
+
+async def scenario_graph(nodes: Recorder, analysis: Recorder, args):
+    from app.services.ai_workflow import arun_analysis
+
+    async def run(i):
+        ticker = f"GRAPH{i}"
+        started = time.perf_counter()
+        finished_at = {}
+
+        async def on_progress(node, update):
+            finished_at[node] = time.perf_counter()
+
+        try:
+            await arun_analysis(ticker, on_progress)
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, f"{type(e).__name__}: {e}"
+        analysis.record("run_analysis", time.perf_counter() - started, ok, error)
+        for node, done in finished_at.items():
+            ready = max((finished_at.get(parent, started) for parent in GRAPH_PREDECESSORS.get(node, [])), default=started)
+            nodes.record(node, done - ready)
+
+    await bounded(args.concurrency, [run(i) for i in range(args.graph_runs)])
+
+
+async def run(args):
+    import httpx
+    from app.core.http import set_http_client
+    from app.db.models import Base
+    from app.db.session import engine
+    from app.main import app
+    from app.services import ai_workflow
+    from app.services.llm import FakeStructuredChatModel, InMemoryResponseCache, NullResponseCache, configure_llm
+    from app.services.market_data import FakeMarketDataProvider, build_market_data_provider, set_market_data_provider
+    from app.services.ticker_index import ticker_index
+
+    Base.metadata.create_all(engine)
+
+    fake_market_data = FakeMarketDataProvider(latency=args.yfinance_latency)
+    set_market_data_provider(build_market_data_provider(fake_market_data) if args.warm_caches else fake_market_data)
+    fake_search = FakeSearchTool(latency=args.tavily_latency)
+    ai_workflow.set_search_tool(fake_search)
+    fake_models = []
+
+    def chat_model_factory(model_name):
+        fast = args.fast_llm_latency is not None and "flash" in model_name
+        model = FakeStructuredChatModel(model_name, latency=args.fast_llm_latency if fast else args.llm_latency)
+        fake_models.append(model)
+        return model
+
+    configure_llm(chat_model_factory, InMemoryResponseCache() if args.warm_caches else NullResponseCache())
+    set_http_client(httpx.AsyncClient(transport=fake_http_transport(args.http_latency, args.listing_size)))
+
+    endpoints, nodes, analysis = Recorder(), Recorder(), Recorder()
+    scenario_seconds = {}
+    async with app.router.lifespan_context(app):
+        await ticker_index.refresh()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for name, scenario in (
+                ("auth", lambda: scenario_auth(client, endpoints, args)),
+                ("search", lambda: scenario_search(client, endpoints, args)),
+                ("analysis", lambda: scenario_analysis(client, endpoints, analysis, args)),
+            ):
+                started = time.perf_counter()
+                await scenario()
+                scenario_seconds[name] = time.perf_counter() - started
+        started = time.perf_counter()
+        await scenario_graph(nodes, analysis, args)
+        scenario_seconds["graph"] = time.perf_counter() - started
+
+    return {
+        "meta": {
+            "git_revision": git_revision(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "config": vars(args),
+        },
+        "scenario_seconds": scenario_seconds,
+        "endpoints": endpoints.summary(),
+        "nodes": nodes.summary(),
+        "analysis": analysis.summary(),
+        "external_calls": {
+            "yfinance": dict(fake_market_data.calls),
+            "tavily": fake_search.calls,
+            "gemini": sum(model.calls for model in fake_models),
+        },
+    }
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="advisor-benchmark-")
+    overrides = {
+        "BCRYPT_ROUNDS": args.bcrypt_rounds,
+        "OUTBOUND_LIMITER_PATH": os.path.join(workdir, "rate_limits.sqlite3"),
+        "OUTBOUND_RATE_LIMITS": json.dumps({provider: args.outbound_rate for provider in ("gemini", "tavily", "fmp", "yfinance")}),
+        "OUTBOUND_DEFAULT_RATE": args.outbound_rate,
+    }
+    if not args.warm_caches:
+        overrides.update({"ANALYSIS_CACHE_TTL_SECONDS": 0, "MARKET_DATA_CACHE_PATH": "", "LLM_CACHE_BACKEND": "none"})
+    else:
+        overrides["MARKET_DATA_CACHE_PATH"] = os.path.join(workdir, "market_data.sqlite3")
+    configure_environment(f"sqlite:///{workdir}/benchmark.sqlite3?timeout=30", **overrides)
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        report = asyncio.run(run(args))
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        for line in compare(report, baseline):
+            print(line, file=sys.stderr)
+
+    # Failed requests finish fast and would otherwise read as a speed-up
+    errors = error_lines(report)
+    if errors:
+        print("\nBENCHMARK RUN HAD ERRORS; the numbers above are not a valid measurement:", file=sys.stderr)
+        for line in errors:
+            print(f"  {line}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Offline stand-ins for every external service the app talks to. Each one sleeps for a
+configurable latency so the benchmark exercises the same concurrency as production.
+"""
+import asyncio
+import hashlib
+
+import httpx
+
+COMPANY_NAMES = [
+    "Apple Inc.", "Microsoft Corporation", "Amazon.com Inc.", "Alphabet Inc.", "Meta Platforms Inc.",
+    "NVIDIA Corporation", "Tesla Inc.", "Berkshire Hathaway Inc.", "JPMorgan Chase & Co.", "Visa Inc.",
+]
+TICKERS = ["AAPL", "MSFT", "AMZN", "GOOGL", "META", "NVDA", "TSLA", "BRK-B", "JPM", "V"]
+
+
+def synthetic_listing(size: int):
+    """FMP /stock/list style payload: the real symbols above plus generated ones."""
+    listing = [{"symbol": ticker, "name": name} for ticker, name in zip(TICKERS, COMPANY_NAMES)]
+    for i in range(size - len(listing)):
+        digest = hashlib.sha1(str(i).encode()).hexdigest().upper()
+        listing.append({"symbol": digest[:4] + str(i % 10), "name": f"Synthetic Holdings {digest[4:10]} Corp"})
+    return listing
+
+
+class FakeSearchTool:
+    """Replaces TavilySearchResults and its API wrapper: returns `max_results` news snippets per query."""
+
+    def __init__(self, latency: float = 0.0, max_results: int = 4):
+        self.latency = latency
+        self.max_results = max_results
+        self.calls = 0
+        self.api_wrapper = self
+
+    async def results_async(self, query: str, max_results: int):
+        await asyncio.sleep(self.latency)
+        self.calls += 1
+        return [
+            {"url": f"https://news.example.com/{i}", "content": f"Result {i} for '{query}': revenue beat estimates, guidance raised."}
+            for i in range(max_results)
+        ]
+
+
+def fake_http_transport(latency: float = 0.0, listing_size: int = 5000) -> httpx.MockTransport:
+    """Answers the FMP and restcountries endpoints the API calls."""
+    listing = synthetic_listing(listing_size)
+    countries = [{"name": {"common": name}, "cca2": code} for name, code in
+                 [("United States", "US"), ("India", "IN"), ("Germany", "DE"), ("Japan", "JP"), ("Brazil", "BR")]]
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        path = request.url.path
+        if path.endswith("/stock/list"):
+            return httpx.Response(200, json=listing)
+        if path.endswith("/search-ticker"):
+            query = request.url.params.get("query", "").lower()
+            matches = [item for item in listing if query in item["symbol"].lower() or query in item["name"].lower()]
+            limit = int(request.url.params.get("limit", 10))
+            return httpx.Response(200, json=matches[:limit])
+        if path.endswith("/v3.1/all"):
+            return httpx.Response(200, json=countries)
+        return httpx.Response(404, json={"detail": "not faked"})
+
+    return httpx.MockTransport(handler)
@@ -0,0 +1,102 @@
+"""
+Cold-start benchmark: import time, peak RSS and which heavy libraries each entry point loads.
+
+    python -m benchmarks.startup [--runs 5] [--output startup.json] [--baseline old.json]
+
+Every measurement runs in a fresh interpreter so nothing is cached in sys.modules:
+  api             import app.main
+  worker          import app.worker (the AI stack loads on warm-up or the first job)
+  workflow        import app.services.ai_workflow
+  workflow_warm   the above plus warm_up(): graph compilation, search tool and chat models
+
+Reports the median over --runs of the in-process import time and the process's peak RSS.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.common import configure_environment, git_revision
+
+HEAVY_MODULES = [
+    "langchain_core", "langchain_community", "langgraph", "langchain_google_genai",
+    "google.generativeai", "tavily", "yfinance", "pandas", "numpy",
+]
+
+TARGETS = {
+    "api": "import app.main",
+    "worker": "import app.worker",
+    "workflow": "import app.services.ai_workflow",
+    "workflow_warm": "import app.services.ai_workflow as workflow; workflow.warm_up()",
+}
+
+CHILD = """
+import json, resource, sys, time
+started = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - started
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# ru_maxrss is in KiB on Linux and in bytes on macOS
+rss_mb = rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss_mb, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(code: str) -> dict:
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD.format(code=code, heavy=HEAVY_MODULES)],
+        capture_output=True, text=True, env=os.environ.copy(),
+    )
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--targets", nargs="*", default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="advisor-startup-")
+    configure_environment(f"sqlite:///{workdir}/startup.sqlite3", LLM_CACHE_BACKEND="none", MARKET_DATA_CACHE_PATH="")
+
+    report = {"meta": {"git_revision": git_revision(), "runs": args.runs}, "targets": {}}
+    for name in args.targets:
+        samples = [measure(TARGETS[name]) for _ in range(args.runs)]
+        ok = [sample for sample in samples if "error" not in sample]
+        if not ok:
+            report["targets"][name] = {"error": samples[-1]["error"]}
+            continue
+        report["targets"][name] = {
+            "seconds_median": statistics.median(sample["seconds"] for sample in ok),
+            "rss_mb_median": statistics.median(sample["rss_mb"] for sample in ok),
+            "heavy_modules_loaded": ok[-1]["loaded"],
+            "failed_runs": len(samples) - len(ok),
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle).get("targets", {})
+        for name, current in report["targets"].items():
+            before = baseline.get(name)
+            if not before or "error" in before or "error" in current:
+                continue
+            print(f"{name}: {before['seconds_median']:.2f} -> {current['seconds_median']:.2f} s, "
+                  f"{before['rss_mb_median']:.0f} -> {current['rss_mb_median']:.0f} MB RSS", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+-- Completion time of an analysis; the result cache serves logs updated inside its freshness window
+ALTER TABLE analysis_logs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE;
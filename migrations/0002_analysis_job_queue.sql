@@ -0,0 +1,6 @@
+-- Durable job queue: workers claim analysis_logs rows and retry them up to ANALYSIS_MAX_ATTEMPTS times
+ALTER TABLE analysis_logs
+    ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS worker_id VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP WITH TIME ZONE,
+    ADD COLUMN IF NOT EXISTS error TEXT;
@@ -0,0 +1,16 @@
+-- Batch analyses: one analysis_batches job with a child analysis_logs row per ticker
+CREATE TABLE IF NOT EXISTS analysis_batches (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users (id),
+    status VARCHAR(20) DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id VARCHAR(100),
+    claimed_at TIMESTAMP WITH TIME ZONE,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    updated_at TIMESTAMP WITH TIME ZONE
+);
+CREATE INDEX IF NOT EXISTS ix_analysis_batches_id ON analysis_batches (id);
+
+ALTER TABLE analysis_logs ADD COLUMN IF NOT EXISTS batch_id INTEGER REFERENCES analysis_batches (id);
+CREATE INDEX IF NOT EXISTS ix_analysis_logs_batch_id ON analysis_logs (batch_id);
@@ -0,0 +1,2 @@
+-- Output of each finished graph node, streamed to clients over SSE and WebSocket
+ALTER TABLE analysis_logs ADD COLUMN IF NOT EXISTS progress_json JSON;
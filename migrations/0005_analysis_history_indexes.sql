@@ -0,0 +1,5 @@
+-- Keyset pagination for the history endpoints: newest first on (created_at, id), per filter
+CREATE INDEX IF NOT EXISTS ix_analysis_logs_created_at_id ON analysis_logs (created_at, id);
+CREATE INDEX IF NOT EXISTS ix_analysis_logs_user_created_at_id ON analysis_logs (user_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_analysis_logs_company_created_at_id ON analysis_logs (company_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_analysis_logs_status_created_at_id ON analysis_logs (status, created_at, id);
@@ -0,0 +1,2 @@
+-- Graph intermediates with content hashes, so unchanged steps are reused on the next run
+ALTER TABLE analysis_logs ADD COLUMN IF NOT EXISTS intermediate_json JSON;
@@ -0,0 +1,14 @@
+-- Analysis requests per company and UTC day; the cache-warming scheduler ranks companies by them
+CREATE TABLE IF NOT EXISTS company_request_counts (
+    company_id INTEGER NOT NULL REFERENCES companies (id),
+    day DATE NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (company_id, day)
+);
+CREATE INDEX IF NOT EXISTS ix_company_request_counts_day ON company_request_counts (day);
+
+-- Replaced by company_request_counts
+DROP INDEX IF EXISTS ix_companies_last_requested_at;
+ALTER TABLE companies
+    DROP COLUMN IF EXISTS request_count,
+    DROP COLUMN IF EXISTS last_requested_at;
@@ -0,0 +1,13 @@
+-- Single-flight: at most one queued or running stand-alone analysis per company.
+-- Duplicates queued before this index existed are failed first, keeping the oldest.
+UPDATE analysis_logs
+SET status = 'failed', error = 'Duplicate of an analysis already in flight'
+WHERE status IN ('pending', 'running') AND batch_id IS NULL
+  AND id NOT IN (
+      SELECT MIN(id) FROM analysis_logs
+      WHERE status IN ('pending', 'running') AND batch_id IS NULL
+      GROUP BY company_id
+  );
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_analysis_logs_inflight_company ON analysis_logs (company_id)
+    WHERE status IN ('pending', 'running') AND batch_id IS NULL;
@@ -0,0 +1,36 @@
+import os
+import tempfile
+
+# Settings are read when app.core.config is imported, so configure a throwaway SQLite database first
+_db_dir = tempfile.mkdtemp(prefix="investment-advisor-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.sqlite3')}"
+for name in ("JWT_SECRET_KEY", "GOOGLE_API_KEY", "TAVILY_API_KEY", "FINANCIAL_MODELING_PREP_API_KEY",
+             "EMAIL_API_KEY", "SENDER_EMAIL"):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+os.environ.setdefault("REFRESH_TOKEN_EXPIRE_DAYS", "7")
+
+import pytest
+
+from app.db import models
+from app.db.session import SessionLocal, engine
+
+
+@pytest.fixture
+def db():
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def company(db):
+    company = models.Company(name="Apple Inc.", ticker_symbol="AAPL")
+    db.add(company)
+    db.commit()
+    return company
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from app.db import models
+from app.db.session import AsyncSessionLocal
+from app.services.analysis_history import InvalidCursor, list_analyses
+
+
+def all_pages(limit, **filters):
+    async def fetch():
+        pages, cursor = [], None
+        async with AsyncSessionLocal() as session:
+            while True:
+                items, cursor = await list_analyses(session, limit=limit, cursor=cursor, **filters)
+                pages.append([item["id"] for item in items])
+                if cursor is None or len(pages) > 20:
+                    return pages
+
+    return asyncio.run(fetch())
+
+
+def add_logs(db, company, count, **fields):
+    # One transaction, like a batch insert: every row gets the same created_at
+    logs = [models.AnalysisLog(company_id=company.id, status='completed', attempts=1, **fields) for _ in range(count)]
+    db.add_all(logs)
+    db.commit()
+    return [log.id for log in logs]
+
+
+def test_pages_walk_rows_sharing_one_created_at_exactly_once(db, company):
+    ids = add_logs(db, company, 10)
+    assert len({created_at for (created_at,) in db.query(models.AnalysisLog.created_at)}) == 1
+
+    pages = all_pages(3)
+
+    assert pages == [ids[9:6:-1], ids[6:3:-1], ids[3:0:-1], ids[:1]]
+
+
+def test_a_full_last_page_has_no_cursor(db, company):
+    ids = add_logs(db, company, 6)
+
+    assert all_pages(3) == [ids[5:2:-1], ids[2::-1]]
+
+
+def test_filters_apply_on_every_page(db, company):
+    other = models.Company(name="Microsoft", ticker_symbol="MSFT")
+    db.add(other)
+    db.commit()
+    failed = add_logs(db, company, 4, error="boom")
+    add_logs(db, other, 4)
+    db.query(models.AnalysisLog).filter(models.AnalysisLog.id.in_(failed)).update({"status": 'failed'})
+    db.commit()
+
+    assert all_pages(3, status='failed') == [failed[:0:-1], failed[:1]]
+    assert all_pages(3, company_id=company.id) == [failed[:0:-1], failed[:1]]
+
+
+def test_a_malformed_cursor_is_rejected(db):
+    async def fetch():
+        async with AsyncSessionLocal() as session:
+            await list_analyses(session, cursor="not-a-cursor")
+
+    with pytest.raises(InvalidCursor):
+        asyncio.run(fetch())
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+from datetime import timedelta
+
+from app.core.config import settings
+from app.db import models
+from app.db.session import AsyncSessionLocal, SessionLocal
+from app.services.analysis_jobs import (
+    _now, claim_next_analysis, complete_analysis, enqueue_analysis, enqueue_statement, fail_job,
+    get_or_create_companies, heartbeat_jobs, record_progress,
+)
+
+
+def add_jobs(db, count):
+    # One company per job: a company has at most one stand-alone analysis in flight
+    companies = [models.Company(name=f"Company {n}", ticker_symbol=f"T{n}") for n in range(count)]
+    db.add_all(companies)
+    db.flush()
+    logs = [models.AnalysisLog(company_id=company.id, status='pending', attempts=0) for company in companies]
+    db.add_all(logs)
+    db.commit()
+    return [log.id for log in logs]
+
+
+def stop_heartbeat(db, analysis_id):
+    db.query(models.AnalysisLog).filter(models.AnalysisLog.id == analysis_id).update(
+        {"claimed_at": _now() - timedelta(seconds=settings.ANALYSIS_CLAIM_TIMEOUT_SECONDS + 1)}
+    )
+    db.commit()
+
+
+def test_a_claimed_job_is_not_handed_to_a_second_worker(db):
+    [job_id] = add_jobs(db, 1)
+
+    assert claim_next_analysis(db, "w1").id == job_id
+    assert claim_next_analysis(db, "w2") is None
+
+
+def test_racing_workers_claim_each_job_exactly_once(db):
+    job_ids = add_jobs(db, 5)
+    start = threading.Barrier(8)
+    claims = []
+
+    def worker(worker_id):
+        session = SessionLocal()
+        try:
+            start.wait()
+            while (job := claim_next_analysis(session, worker_id)) is not None:
+                claims.append((job.id, worker_id))
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=worker, args=(f"w{n}",)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(job_id for job_id, _ in claims) == job_ids
+    db.expire_all()
+    for job_id, worker_id in claims:
+        log = db.get(models.AnalysisLog, job_id)
+        assert (log.status, log.worker_id, log.attempts) == ('running', worker_id, 1)
+
+
+def test_a_job_whose_heartbeat_stopped_is_reclaimed(db):
+    [job_id] = add_jobs(db, 1)
+    claim_next_analysis(db, "w1")
+    record_progress(db, job_id, "w1", "financial_analyst", {"summary": "first attempt"})
+
+    heartbeat_jobs(db, models.AnalysisLog, [job_id], "w1")
+    assert claim_next_analysis(db, "w2") is None
+
+    stop_heartbeat(db, job_id)
+    job = claim_next_analysis(db, "w2")
+    assert (job.id, job.worker_id, job.attempts) == (job_id, "w2", 2)
+    assert job.progress_json is None
+
+
+def test_a_stale_job_is_not_reclaimed_after_its_last_attempt(db):
+    [job_id] = add_jobs(db, 1)
+    for attempt in range(settings.ANALYSIS_MAX_ATTEMPTS):
+        assert claim_next_analysis(db, f"w{attempt}").id == job_id
+        stop_heartbeat(db, job_id)
+
+    assert claim_next_analysis(db, "late") is None
+
+
+def test_a_reclaimed_job_ignores_writes_from_its_previous_worker(db):
+    [job_id] = add_jobs(db, 1)
+    claim_next_analysis(db, "w1")
+    stop_heartbeat(db, job_id)
+    claim_next_analysis(db, "w2")
+
+    assert complete_analysis(db, job_id, "w1", {"report": "stale"}) is False
+    assert fail_job(db, models.AnalysisLog, job_id, "w1", "stale failure") is None
+    record_progress(db, job_id, "w1", "financial_analyst", {"summary": "stale"})
+    db.expire_all()
+    log = db.get(models.AnalysisLog, job_id)
+    assert (log.status, log.worker_id, log.result_json, log.error, log.progress_json) == (
+        'running', "w2", None, None, None
+    )
+
+    assert complete_analysis(db, job_id, "w2", {"report": "fresh"}) is True
+    db.expire_all()
+    log = db.get(models.AnalysisLog, job_id)
+    assert (log.status, log.result_json) == ('completed', {"report": "fresh"})
+
+
+def test_a_failed_job_is_requeued_until_its_attempts_run_out(db):
+    [job_id] = add_jobs(db, 1)
+    for attempt in range(1, settings.ANALYSIS_MAX_ATTEMPTS + 1):
+        claim_next_analysis(db, "w1")
+        expected = 'pending' if attempt < settings.ANALYSIS_MAX_ATTEMPTS else 'failed'
+        assert fail_job(db, models.AnalysisLog, job_id, "w1", "boom") == expected
+
+
+def test_concurrent_requests_for_a_new_ticker_share_one_company_and_one_job(db):
+    async def request():
+        async with AsyncSessionLocal() as session:
+            company = (await get_or_create_companies(session, ["MSFT"]))["MSFT"]
+            return (await enqueue_analysis(session, company.id)).id
+
+    async def burst():
+        return await asyncio.gather(*[request() for _ in range(20)])
+
+    assert len(set(asyncio.run(burst()))) == 1
+    assert db.query(models.Company).count() == 1
+    assert db.query(models.AnalysisLog).count() == 1
+
+
+def test_a_company_gets_a_new_job_once_the_previous_one_finished(db, company):
+    statement = lambda: enqueue_statement(db.get_bind().dialect.name, company.id)
+    assert db.execute(statement()).rowcount == 1
+    assert db.execute(statement()).rowcount == 0
+    db.commit()
+
+    job = claim_next_analysis(db, "w1")
+    complete_analysis(db, job.id, "w1", {"report": "done"})
+    assert db.execute(statement()).rowcount == 1
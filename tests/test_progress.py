@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+from app.services.progress import Subscription
+
+
+def row(status, attempts, progress=None, result=None, error=None):
+    return SimpleNamespace(id=1, status=status, attempts=attempts, progress_json=progress,
+                           result_json=result, error=error)
+
+
+def kinds(events):
+    return [(event["event"], event["data"].get("node") or event["data"].get("status")) for event in events]
+
+
+def test_each_node_is_sent_once():
+    subscription = Subscription(1)
+
+    assert kinds(subscription.events_for(row('running', 1, {"data_collector": {}}))) == [
+        ("status", "running"), ("node", "data_collector"),
+    ]
+    assert subscription.events_for(row('running', 1, {"data_collector": {}})) == []
+    assert kinds(subscription.events_for(row('completed', 1, {"data_collector": {}}, {"report": 1}))) == [
+        ("completed", None),
+    ]
+
+
+def test_a_retry_streams_its_nodes_again():
+    subscription = Subscription(1)
+    subscription.events_for(row('running', 1, {"data_collector": {"try": 1}, "financial_analyst": {"try": 1}}))
+
+    # Reclaimed after a missed heartbeat: still running, progress cleared, then refilled
+    events = subscription.events_for(row('running', 2))
+    assert kinds(events) == [("status", "running")]
+    assert events[0]["data"]["attempt"] == 2
+
+    events = subscription.events_for(row('running', 2, {"data_collector": {"try": 2}}))
+    assert kinds(events) == [("node", "data_collector")]
+    assert events[0]["data"]["output"] == {"try": 2}
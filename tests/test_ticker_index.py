@@ -0,0 +1,41 @@
+from app.core.config import settings
+from app.services.ticker_index import TickerIndex
+
+ENTRIES = [
+    {"name": "Apple Inc.", "ticker_symbol": "AAPL"},
+    {"name": "Applied Materials Inc.", "ticker_symbol": "AMAT"},
+    {"name": "International Business Machines Corp", "ticker_symbol": "IBM"},
+    {"name": "Microsoft Corporation", "ticker_symbol": "MSFT"},
+] + [{"name": f"Generic Holdings {n} Inc", "ticker_symbol": f"GEN{n}"} for n in range(2000)]
+
+
+def symbols(results):
+    return [entry["ticker_symbol"] for entry in results]
+
+
+def test_typos_find_the_company():
+    index = TickerIndex(ENTRIES)
+
+    assert symbols(index.search("aple"))[0] == "AAPL"
+    assert symbols(index.search("microsft"))[0] == "MSFT"
+    assert symbols(index.search("internatonal busines"))[0] == "IBM"
+
+
+def test_fuzzy_lookups_score_at_most_the_candidate_budget(monkeypatch):
+    monkeypatch.setattr(settings, "TICKER_INDEX_FUZZY_MAX_CANDIDATES", 100)
+    index = TickerIndex(ENTRIES)
+
+    matches = index._fuzzy_matches("generic holdngs")
+
+    assert 0 < len(matches) <= 100
+    assert symbols(index.search("microsft"))[0] == "MSFT"
+
+
+def test_added_entries_search_like_a_rebuilt_index():
+    extra = [{"name": "Nvidia Corporation", "ticker_symbol": "NVDA"}, {"name": "Duplicate", "ticker_symbol": "aapl"}]
+    rebuilt = TickerIndex(ENTRIES + extra)
+    extended = TickerIndex(ENTRIES)
+
+    assert extended.add(extra) == 1
+    for query in ("nvda", "nvidia", "nvidai corp", "aapl", "apple", "generic 12"):
+        assert symbols(extended.search(query)) == symbols(rebuilt.search(query))